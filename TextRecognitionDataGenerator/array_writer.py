@@ -0,0 +1,136 @@
+"""
+Writes the generated lines as packed grayscale pixels, so that training can read them without decoding.
+The files in the output directory are:
+
+    lines-<part>.bin   uint8 grayscale lines of one worker, packed back to back (height * width bytes each)
+    labels-<part>.bin  the UTF-8 labels of the same lines, back to back
+    index.npy          one record per line of the run: the lines file of its part, the byte offset,
+                       height and width of the line and byte offset and size of its label.
+                       Rows with width 0 were not generated (or skipped, see the manifest).
+
+Row i is line first_index + i (first_index is the first index of the run, see manifest.json).
+Every worker appends to its own part, flushed after each line. The parent writes index.npy from the
+manifest records at the end of the run, so lines a killed worker left half written are never indexed.
+"""
+
+import json
+import os
+import threading
+import uuid
+
+import numpy as np
+
+from manifest import RECORDS_NAME, sample_record
+
+INDEX_NAME = 'index.npy'
+
+INDEX_DTYPE = np.dtype([
+    ('part', 'S64'),
+    ('offset', '<i8'),
+    ('height', '<i4'),
+    ('width', '<i4'),
+    ('label_offset', '<i8'),
+    ('label_size', '<i4'),
+])
+
+class ArrayWriter(object):
+    """
+        Appends the grayscale lines of one process to its own part of the dataset in out_dir.
+        Lines wider than max_width (if > 0) are not written, their record says why.
+    """
+
+    def __init__(self, out_dir, max_width=0):
+        self.max_width = max_width
+        # Unique per writer, so that workers and resumed runs never write the same part
+        part = uuid.uuid4().hex[:12]
+        self.lines_name = 'lines-{}.bin'.format(part)
+        self.labels_name = 'labels-{}.bin'.format(part)
+        self._lines = open(os.path.join(out_dir, self.lines_name), 'ab')
+        self._labels = open(os.path.join(out_dir, self.labels_name), 'ab')
+        self._lines_size = 0
+        self._labels_size = 0
+        # The lines can be written from the threads of a WritePool
+        self._lock = threading.Lock()
+
+    def write(self, index, image_name, image, text):
+        """
+            Append line index, returns its manifest record
+        """
+
+        pixels = np.asarray(image.convert('L'))
+        height, width = pixels.shape
+        if self.max_width > 0 and width > self.max_width:
+            return {'index': index, 'image': image_name, 'skipped': 'width {} above the maximum width {}'.format(width, self.max_width)}
+
+        image_data = pixels.tobytes()
+        label_data = text.encode('utf8')
+
+        with self._lock:
+            offset, label_offset = self._lines_size, self._labels_size
+            self._lines.write(image_data)
+            self._labels.write(label_data)
+            # A line is only recorded as done once it is written, flushed so it survives a killed worker
+            self._lines.flush()
+            self._labels.flush()
+            self._lines_size += len(image_data)
+            self._labels_size += len(label_data)
+
+        return sample_record(
+            index, image_name, image_data, label_data,
+            part=self.lines_name, offset=offset, height=height, width=width, label_offset=label_offset
+        )
+
+    def close(self):
+        self._lines.close()
+        self._labels.close()
+
+def write_index(out_dir, first_index, end_index):
+    """
+        Write index.npy for the lines [first_index, end_index) from the records in manifest.jsonl
+    """
+
+    index = np.zeros((end_index - first_index,), dtype=INDEX_DTYPE)
+    with open(os.path.join(out_dir, RECORDS_NAME), 'r', encoding='utf8') as f:
+        for line in f:
+            record = json.loads(line)
+            if 'part' not in record or not first_index <= record['index'] < end_index:
+                continue
+            index[record['index'] - first_index] = (
+                record['part'], record['offset'], record['height'], record['width'],
+                record['label_offset'], record['label_size']
+            )
+    np.save(os.path.join(out_dir, INDEX_NAME), index)
+    return index
+
+def open_dataset(out_dir):
+    """
+        Open a dataset written by ArrayWriter read only, returns (index, parts) with
+        parts mapping the lines file of every part to its (lines, labels) memmaps
+    """
+
+    index = np.load(os.path.join(out_dir, INDEX_NAME))
+    parts = {}
+    for part in set(index['part'][index['width'] > 0]):
+        lines_name = part.decode('ascii')
+        labels_name = 'labels-' + lines_name.split('-', 1)[1]
+        parts[part] = tuple(
+            np.memmap(os.path.join(out_dir, name), mode='r', dtype=np.uint8)
+            if os.path.getsize(os.path.join(out_dir, name)) > 0 else np.zeros(0, dtype=np.uint8)
+            for name in (lines_name, labels_name)
+        )
+    return index, parts
+
+def read_line(dataset, i):
+    """
+        Get (image, label) of row i of an opened dataset, the image is a view into the file
+    """
+
+    index, parts = dataset
+    entry = index[i]
+    if entry['width'] == 0:
+        raise ValueError('Line {} of the dataset was not generated'.format(i))
+    lines, labels = parts[entry['part']]
+    size = int(entry['height']) * int(entry['width'])
+    pixels = lines[entry['offset']:entry['offset'] + size].reshape(entry['height'], entry['width'])
+    label = labels[entry['label_offset']:entry['label_offset'] + entry['label_size']]
+    return pixels, label.tobytes().decode('utf8')
@@ -1,87 +1,224 @@
-import cv2
 import math
 import os
-import random
 import numpy as np
 
 from PIL import Image, ImageDraw, ImageFilter
 
-def gaussian_noise(height, width):
+from memory_cache import MemoryBoundedCache
+from seeding import get_rng
+
+# Default memory budget of the decoded picture pool
+PICTURE_POOL_MAX_BYTES = 256 * 1024 * 1024
+
+# Pictures narrower than a line are scaled to the line width. With a step above 1 the width is
+# rounded up to it, so lines of similar width share one scaled picture, but the crops of short
+# lines then come from a picture scaled up further than before. Set with configure_picture_pool.
+_picture_width_step = 1
+
+_picture_pool = MemoryBoundedCache(PICTURE_POOL_MAX_BYTES)
+_picture_names = {}
+
+# Default memory budget of the cached plain and noise backgrounds
+BACKGROUND_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# Cached backgrounds are made for widths rounded up to this step, and noise tiles twice as wide
+BACKGROUND_WIDTH_STEP = 256
+
+# Noise tiles per (height, width step), a line gets a random crop of a random tile
+NOISE_TILE_COUNT = 4
+# The tiles are the same in every process, so that seeded runs do not depend on the process
+NOISE_TILE_SEED = 0
+
+_background_cache = MemoryBoundedCache(BACKGROUND_CACHE_MAX_BYTES)
+
+# All backgrounds are RGBA images, or single channel L images with grayscale set
+
+def _to_mode(image, grayscale):
+    return image.convert('L' if grayscale else 'RGBA')
+
+def configure_background_cache(max_bytes):
     """
-        Create a background with Gaussian noise (to mimic paper)
+        Set the memory budget of the per-process cache of plain and noise backgrounds,
+        0 disables it and every background is generated for its line
     """
 
-    # We create an all white image
-    image = np.ones((height, width)) * 255
+    global _background_cache
+    _background_cache = MemoryBoundedCache(max_bytes) if max_bytes > 0 else None
 
-    # We add gaussian noise
-    cv2.randn(image, 235, 10)
+def background_cache_info():
+    return _background_cache.info() if _background_cache is not None else None
 
-    return Image.fromarray(image).convert('RGBA')
+def _cached_background(key, nbytes, create):
+    """
+        The cached array of key, created if missing. None if the cache is disabled
+        or an array of nbytes would not fit into it.
+    """
 
-def plain_white(height, width):
+    if _background_cache is None or nbytes > _background_cache.max_bytes:
+        return None
+
+    def create_read_only():
+        # Images made from a cached array share its memory, PIL copies them before changing them
+        array = create()
+        array.flags.writeable = False
+        return array
+
+    return _background_cache.get_or_create(key, create_read_only)
+
+def _background_width(width):
+    return -(-width // BACKGROUND_WIDTH_STEP) * BACKGROUND_WIDTH_STEP
+
+def _noise_tiles(height, tile_width, grayscale):
+    rng = np.random.default_rng([NOISE_TILE_SEED, height, tile_width])
+    return np.stack([
+        np.array(_to_mode(Image.fromarray(tile), grayscale))
+        for tile in rng.normal(235, 10, (NOISE_TILE_COUNT, height, tile_width))
+    ])
+
+def gaussian_noise(height, width, rng=None, grayscale=False):
     """
-        Create a plain white background
+        Create a background with Gaussian noise (to mimic paper). With the background
+        cache it is a random crop, possibly mirrored, of a pre-generated noise tile.
     """
 
-    return Image.new("L", (width, height), 255).convert('RGBA')
+    rng = get_rng(rng)
+
+    tile_width = 2 * _background_width(width)
+    tiles = _cached_background(
+        ('noise', height, tile_width, grayscale),
+        NOISE_TILE_COUNT * height * tile_width * (1 if grayscale else 4),
+        lambda: _noise_tiles(height, tile_width, grayscale)
+    )
+    if tiles is not None:
+        x = int(rng.integers(0, tile_width - width, endpoint=True))
+        crop = tiles[rng.integers(NOISE_TILE_COUNT), :, x:x + width]
+        if rng.integers(2):
+            crop = crop[:, ::-1]
+        return Image.fromarray(np.ascontiguousarray(crop))
 
-def quasicrystal(height, width):
+    # We create gaussian noise around a light grey
+    image = rng.normal(235, 10, (height, width))
+
+    return _to_mode(Image.fromarray(image), grayscale)
+
+def plain_white(height, width, grayscale=False):
+    """
+        Create a plain white background, with the background cache a copy of a cached one
+    """
+
+    cached_width = _background_width(width)
+    white = _cached_background(
+        ('plain', height, cached_width, grayscale),
+        height * cached_width * (1 if grayscale else 4),
+        lambda: np.array(_to_mode(Image.new("L", (cached_width, height), 255), grayscale))
+    )
+    if white is not None:
+        return Image.fromarray(white[:, :width])
+
+    return _to_mode(Image.new("L", (width, height), 255), grayscale)
+
+def quasicrystal(height, width, rng=None, grayscale=False):
     """
         Create a background with quasicrystal (https://en.wikipedia.org/wiki/Quasicrystal)
     """
 
-    image = Image.new("L", (width, height))
-    pixels = image.load()
+    rng = get_rng(rng)
+    frequency = rng.random() * 30 + 20 # frequency
+    phase = rng.random() * 2 * math.pi # phase
+    rotation_count = int(rng.integers(10, 20, endpoint=True)) # of rotations
+
+    # Rows go along x, columns along y, both in [-2 pi, 2 pi]
+    x = (np.arange(height, dtype=np.float64) / (height - 1) * 4 * math.pi - 2 * math.pi)[:, None]
+    y = (np.arange(width, dtype=np.float64) / (width - 1) * 4 * math.pi - 2 * math.pi)[None, :]
+
+    r = np.hypot(x, y)
+    angle = np.arctan2(y, x)
+
+    z = np.zeros((height, width))
+    for i in range(rotation_count):
+        z += np.cos(r * np.sin(angle + i * math.pi * 2.0 / rotation_count) * frequency + phase)
+
+    # Values above 255 are clipped, the same way the pixel access did
+    c = np.clip(255 - np.round(255 * z / rotation_count), 0, 255).astype(np.uint8)
+
+    return _to_mode(Image.fromarray(c, 'L'), grayscale)
+
+def configure_picture_pool(max_bytes, width_step=1):
+    """
+        Set the memory budget of the per-process pool of decoded pictures and the
+        step narrow pictures are scaled to (1 scales them to the exact line width)
+    """
+
+    global _picture_pool, _picture_width_step
 
-    frequency = random.random() * 30 + 20 # frequency
-    phase = random.random() * 2 * math.pi # phase
-    rotation_count = random.randint(10, 20) # of rotations
+    if width_step < 1:
+        raise ValueError('The picture width step has to be at least 1')
+    _picture_pool = MemoryBoundedCache(max_bytes)
+    _picture_width_step = width_step
 
-    for kw in range(width):
-        y = float(kw) / (width - 1) * 4 * math.pi - 2 * math.pi
-        for kh in range(height):
-            x = float(kh) / (height - 1) * 4 * math.pi - 2 * math.pi
-            z = 0.0
-            for i in range(rotation_count):
-                r = math.hypot(x, y)
-                a = math.atan2(y, x) + i * math.pi * 2.0 / rotation_count
-                z += math.cos(r * math.sin(a) * frequency + phase)
-            c = int(255 - round(255 * z / rotation_count))
-            pixels[kw, kh] = c # grayscale
-    return image.convert('RGBA')
+def picture_pool_info():
+    return _picture_pool.info()
 
-def picture(height, width):
+def _list_pictures(directory):
+    if directory not in _picture_names:
+        _picture_names[directory] = sorted(os.listdir(directory))
+    return _picture_names[directory]
+
+def _decode_picture(path, grayscale):
+    picture = Image.open(path)
+    if grayscale:
+        picture = picture.convert('L')
+    elif picture.mode not in ('L', 'RGB', 'RGBA'):
+        picture = picture.convert('RGB')
+    return np.array(picture)
+
+def _scaled_picture(path, height, width, grayscale=False):
+    """
+        Get the picture as array, scaled so that a width x height crop fits.
+        Widths are rounded up to the picture width step. With grayscale it is pooled as L.
+    """
+
+    path_key = (path, grayscale)
+    decoded = _picture_pool.get_or_create(path_key, lambda: _decode_picture(path, grayscale))
+    picture_height, picture_width = decoded.shape[:2]
+
+    if picture_width < width:
+        width = min(-(-width // _picture_width_step) * _picture_width_step, 2 * width)
+        key = path_key + ('width', width)
+        size = [width, int(picture_height * (width / picture_width))]
+        scale = lambda picture: picture.resize(size, Image.ANTIALIAS)
+    elif picture_height < height:
+        key = path_key + ('height', height)
+        size = [int(picture_width * (height / picture_height)), height]
+        scale = lambda picture: picture.thumbnail(size, Image.ANTIALIAS) or picture
+    else:
+        return decoded
+
+    return _picture_pool.get_or_create(key, lambda: np.array(scale(Image.fromarray(decoded))))
+
+def picture(height, width, rng=None, grayscale=False):
     """
         Create a background with a picture
     """
 
-    pictures = os.listdir('./pictures')
+    rng = get_rng(rng)
 
-    if len(pictures) > 0:
-        picture = Image.open('./pictures/' + pictures[random.randint(0, len(pictures) - 1)])
+    pictures = _list_pictures('./pictures')
 
-        if picture.size[0] < width:
-            picture = picture.resize([width, int(picture.size[1] * (width / picture.size[0]))], Image.ANTIALIAS)
-        elif picture.size[1] < height:
-            picture.thumbnail([int(picture.size[0] * (height / picture.size[1])), height], Image.ANTIALIAS)
+    if len(pictures) > 0:
+        picture = _scaled_picture('./pictures/' + pictures[rng.integers(len(pictures))], height, width, grayscale)
+        picture_height, picture_width = picture.shape[:2]
 
-        if (picture.size[0] == width):
+        if (picture_width == width):
             x = 0
         else:
-            x = random.randint(0, picture.size[0] - width)
-        if (picture.size[1] == height):
+            x = int(rng.integers(0, picture_width - width, endpoint=True))
+        if (picture_height == height):
             y = 0
         else:
-            y = random.randint(0, picture.size[1] - height)
-            
-        return picture.crop(
-            (
-                x,
-                y,
-                x + width,
-                y + height,
-            )
-        )
+            y = int(rng.integers(0, picture_height - height, endpoint=True))
+
+        # Copy the crop, the pooled picture must not be changed by pasting the text
+        return Image.fromarray(picture[y:y + height, x:x + width].copy())
     else:
         raise Exception('No images where found in the pictures folder!')
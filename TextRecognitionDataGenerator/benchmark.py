@@ -0,0 +1,528 @@
+"""
+Benchmarks for the single stages of the generator. Run from this directory, e.g.
+
+    python benchmark.py quasicrystal -n 20
+
+Without arguments all benchmarks are run. The stages, pipeline and augment benchmarks
+time the generator end to end, with -j the results (per line percentiles, lines per
+second and peak memory) are written as JSON to compare them between commits:
+
+    python benchmark.py stages pipeline augment -j before.json
+    python benchmark.py stages pipeline augment -j after.json -cmp before.json
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from PIL import Image, ImageFilter
+
+import background_generator
+import computer_text_generator
+import degrade
+import distorsion_generator
+import run
+
+from multiprocessing import Pool, Queue, util
+
+from data_generator import FakeTextDataGenerator
+
+SAMPLE_TEXT = 'Pleraque autem eorum quae in Grammaticis'
+SAMPLE_FONT = 'fonts/historic/1557-true_character_occurence.ttf'
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Benchmark the stages of the text line generator.')
+    parser.add_argument(
+        "benchmarks",
+        type=str,
+        nargs="*",
+        help="The benchmarks to run, one of: {}. Defaults to all".format(', '.join(BENCHMARKS)),
+    )
+    parser.add_argument(
+        "-n",
+        "--repeat",
+        type=int,
+        nargs="?",
+        help="Number of timed runs per benchmark",
+        default=10
+    )
+    parser.add_argument(
+        "-f",
+        "--format",
+        type=int,
+        nargs="?",
+        help="Height of the benchmarked lines",
+        default=65
+    )
+    parser.add_argument(
+        "-wd",
+        "--width",
+        type=int,
+        nargs="?",
+        help="Width of the benchmarked lines",
+        default=1500
+    )
+    parser.add_argument(
+        "-c",
+        "--count",
+        type=int,
+        nargs="?",
+        help="Number of lines generated per run of the pool benchmark",
+        default=200
+    )
+    parser.add_argument(
+        "-t",
+        "--thread_count",
+        type=int,
+        nargs="?",
+        help="Maximum number of worker processes for the pool benchmark",
+        default=os.cpu_count()
+    )
+    parser.add_argument(
+        "-ch",
+        "--chunksize",
+        type=int,
+        nargs="?",
+        help="Number of lines sent to a worker at once in the pool benchmark",
+        default=16
+    )
+    parser.add_argument(
+        "-j",
+        "--json",
+        type=str,
+        nargs="?",
+        help="Write the results as JSON to this file",
+        default=None,
+    )
+    parser.add_argument(
+        "-cmp",
+        "--compare",
+        type=str,
+        nargs="?",
+        help="JSON results of an earlier run, the medians are compared with this run",
+        default=None,
+    )
+    return parser.parse_args()
+
+def _timeit(func, repeat):
+    """
+        Run func repeat times, returns the durations in seconds
+    """
+
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+# Every reported measurement, written by -j
+_results = []
+
+def _report(name, durations, lines=None):
+    """
+        Print and record the durations (in seconds) of name. lines is the number of
+        lines one duration covers, the throughput is reported in lines per second.
+    """
+
+    durations = np.array(durations) * 1000
+    result = {
+        'name': name,
+        'runs': len(durations),
+        'mean_ms': float(durations.mean()),
+        'min_ms': float(durations.min()),
+        'p50_ms': float(np.percentile(durations, 50)),
+        'p90_ms': float(np.percentile(durations, 90)),
+        'p99_ms': float(np.percentile(durations, 99)),
+        'max_ms': float(durations.max()),
+    }
+    line = '{:<40} median {:9.3f} ms   p90 {:9.3f} ms   min {:9.3f} ms   max {:9.3f} ms'.format(
+        name, result['p50_ms'], result['p90_ms'], result['min_ms'], result['max_ms']
+    )
+    if lines is not None:
+        result['lines_per_second'] = lines * len(durations) / (durations.sum() / 1000)
+        line += '   {:9.1f} lines/s'.format(result['lines_per_second'])
+    _results.append(result)
+    print(line)
+
+def _peak_rss_mb():
+    """
+        Peak resident set size in MB of this process
+    """
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+def bench_quasicrystal(args):
+    # The comparison with the former per pixel version is in tests/test_background_generator.py
+    _report(
+        'quasicrystal {}x{}'.format(args.format, args.width),
+        _timeit(lambda: background_generator.quasicrystal(args.format, args.width), args.repeat)
+    )
+
+def _text_image(args):
+    return computer_text_generator.generate(SAMPLE_TEXT, SAMPLE_FONT, '#000000', args.format, 0, 0.5, False)
+
+def bench_distorsion(args):
+    image = _text_image(args)
+    functions = [distorsion_generator.sin, distorsion_generator.cos, distorsion_generator.random]
+
+    for distorsion_type, func in enumerate(functions, 1):
+        for distorsion_orientation in range(3):
+            _report(
+                'distorsion -d {} -do {}'.format(distorsion_type, distorsion_orientation),
+                _timeit(
+                    lambda: func(
+                        image,
+                        vertical=(distorsion_orientation == 0 or distorsion_orientation == 2),
+                        horizontal=(distorsion_orientation == 1 or distorsion_orientation == 2)
+                    ),
+                    args.repeat
+                )
+            )
+
+def bench_warp(args):
+    image = degrade._fit_height(np.asarray(_text_image(args).convert('L'), dtype=np.float64) / 255, args.format)
+    # A fixed sigma in the middle of warp's range, the comparison with the former
+    # implementation is in tests/test_degrade.py
+    sigma = 6.0
+
+    for float32, noise_scale in [(False, 1), (True, 1), (False, 4), (True, 2), (True, 4)]:
+        dtype = np.float32 if float32 else np.float64
+        image_dtype = image.astype(dtype)
+        _report(
+            'warp {} noise scale {}'.format(np.dtype(dtype).name, noise_scale),
+            _timeit(
+                lambda: degrade.distort_with_noise(
+                    image_dtype, degrade.bounded_gaussian_noise(image.shape, sigma, 5.0, dtype, noise_scale)
+                ),
+                args.repeat
+            )
+        )
+
+def bench_blobs(args):
+    shape = (args.format, args.width)
+    # The densities blotches uses at strength 1 and 3
+    for density in [1e-4, 3e-4, 9e-4]:
+        for name, func in [('exact', degrade.random_blobs), ('fast', degrade.random_blobs_fast)]:
+            # The fast version has to cover about the same area, the coverage differs from line to line
+            coverage = np.mean([func(shape, density, 10).mean() for _ in range(max(args.repeat, 50))])
+            _report(
+                'blobs {} {:g} (coverage {:.4f})'.format(name, density, coverage),
+                _timeit(lambda: func(shape, density, 10), args.repeat)
+            )
+
+    image = np.ones(shape)
+    for fast in [False, True]:
+        _report(
+            'random_blotches fast={}'.format(fast),
+            _timeit(lambda: degrade.random_blotches(image, 3e-4, 1e-4, fast=fast), args.repeat)
+        )
+
+def bench_handwritten(args):
+    try:
+        import handwritten_text_generator
+    except ImportError:
+        print('{:<40} skipped, tensorflow is not installed'.format('handwritten'))
+        return
+
+    timings = handwritten_text_generator.timings
+    durations = _timeit(lambda: handwritten_text_generator.generate(SAMPLE_TEXT, '#282828'), args.repeat)
+    _report('handwritten model load', [timings['load']])
+    # Without the model load of the first line
+    durations[0] -= timings['load']
+    _report('handwritten line', durations)
+    _report('handwritten word sampling', [timings['sample'] / timings['words']])
+    _report('handwritten word rendering', [timings['render'] / timings['words']])
+
+def _init_pool_worker(fonts, run_args, peaks):
+    """
+        run.init_worker, the worker puts its own peak RSS in MB on peaks when the pool closes it
+    """
+
+    run.init_worker(fonts, run_args)
+    util.Finalize(None, lambda: peaks.put(_peak_rss_mb()), exitpriority=0)
+
+def bench_pool(args):
+    fonts = run.load_fonts('hist')
+    lang_dict = run.load_dict('hist')
+
+    worker_counts = [1]
+    while worker_counts[-1] * 2 <= args.thread_count:
+        worker_counts.append(worker_counts[-1] * 2)
+    if worker_counts[-1] != args.thread_count:
+        worker_counts.append(args.thread_count)
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        run_args = run.parse_arguments(['--output_dir', output_dir, '-f', str(args.format), '-ch', str(args.chunksize)])
+        strings = run.create_strings_from_dict(run_args.length, False, args.count, lang_dict)
+        tasks = [(i, s, fonts[i % len(fonts)]) for i, s in enumerate(strings)]
+
+        for worker_count in worker_counts:
+            peaks = Queue()
+            with Pool(worker_count, initializer=_init_pool_worker, initargs=(fonts, run_args, peaks)) as p:
+                start = time.perf_counter()
+                for _ in p.imap_unordered(FakeTextDataGenerator.generate_from_task, tasks, chunksize=args.chunksize):
+                    pass
+                duration = time.perf_counter() - start
+                # Closed (not terminated) so that the workers run their finalizers
+                p.close()
+                p.join()
+            _report('pool -t {} -ch {}'.format(worker_count, args.chunksize), [duration], len(tasks))
+            worker_peaks = [peaks.get(timeout=10) for _ in range(worker_count)]
+            _results[-1]['worker_peak_rss_mb'] = max(worker_peaks)
+            print('{:<40} peak RSS per worker {:9.1f} MB (largest)'.format('', max(worker_peaks)))
+
+def _timeit_each(func, inputs):
+    """
+        Run func once per input, returns the durations in seconds. A first untimed
+        run keeps one-time costs (imports, caches of the stage) out of the percentiles.
+    """
+
+    inputs = list(inputs)
+    func(inputs[0])
+    durations = []
+    for value in inputs:
+        start = time.perf_counter()
+        func(value)
+        durations.append(time.perf_counter() - start)
+    return durations
+
+def _sample_lines(args, count):
+    """
+        count lines of the default pipeline (computer text, plain white background, no
+        distorsion or blur) as grayscale float images, the input of the augmentations
+    """
+
+    strings = run.create_strings_from_dict(3, False, count, run.load_dict('hist'), seed=0)
+    rng = np.random.default_rng(0)
+    lines = []
+    for text in strings:
+        image = computer_text_generator.generate(text, SAMPLE_FONT, '#282828', args.format, 0, 1.0, False, rng)
+        image = image.resize((max(1, int(image.size[0] * args.format / image.size[1])), args.format), Image.ANTIALIAS)
+        background = background_generator.plain_white(args.format, image.size[0])
+        background.paste(image, (0, 0), image)
+        lines.append(np.asarray(background.convert('L'), dtype=np.float64) / 255)
+    return lines
+
+def bench_stages(args):
+    # Every stage of FakeTextDataGenerator.generate on its own, one run per line of
+    # args.repeat different lines. The inputs are seeded to be comparable between commits.
+    strings = run.create_strings_from_dict(3, False, args.repeat, run.load_dict('hist'), seed=0)
+    rng = np.random.default_rng(0)
+
+    def render(text):
+        return computer_text_generator.generate(text, SAMPLE_FONT, '#282828', args.format, 0, 1.0, False, rng)
+
+    images = [render(text) for text in strings]
+    _report('stage render (word cache)', _timeit_each(render, strings), 1)
+    computer_text_generator.configure_word_cache(0)
+    _report('stage render (no word cache)', _timeit_each(render, strings), 1)
+    computer_text_generator.configure_word_cache(computer_text_generator.WORD_CACHE_MAX_BYTES)
+
+    angles = [int(angle) for angle in rng.integers(-5, 5, len(images), endpoint=True)]
+    _report('stage rotate', _timeit_each(lambda i: images[i].rotate(angles[i], expand=1), range(len(images))), 1)
+
+    functions = [distorsion_generator.sin, distorsion_generator.cos, distorsion_generator.random]
+    for distorsion_type, func in enumerate(functions, 1):
+        _report(
+            'stage distorsion -d {}'.format(distorsion_type),
+            _timeit_each(lambda image: func(image, vertical=True, horizontal=False), images),
+            1
+        )
+
+    def resize(image):
+        return image.resize((int(image.size[0] * args.format / image.size[1]), args.format), Image.ANTIALIAS)
+
+    resized = [resize(image) for image in images]
+    _report('stage resize', _timeit_each(resize, images), 1)
+
+    widths = [image.size[0] for image in resized]
+    for background_type, func in enumerate([
+        background_generator.gaussian_noise,
+        lambda height, width, rng: background_generator.plain_white(height, width),
+        background_generator.quasicrystal,
+        background_generator.picture,
+    ]):
+        _report(
+            'stage background -b {}'.format(background_type),
+            _timeit_each(lambda width: func(args.format, width, rng), widths),
+            1
+        )
+    background_generator.configure_background_cache(0)
+    _report(
+        'stage background -b 0 (no cache)',
+        _timeit_each(lambda width: background_generator.gaussian_noise(args.format, width, rng), widths),
+        1
+    )
+    _report(
+        'stage background -b 1 (no cache)',
+        _timeit_each(lambda width: background_generator.plain_white(args.format, width), widths),
+        1
+    )
+    background_generator.configure_background_cache(background_generator.BACKGROUND_CACHE_MAX_BYTES)
+
+    backgrounds = [background_generator.plain_white(args.format, width) for width in widths]
+    _report(
+        'stage paste',
+        _timeit_each(lambda i: backgrounds[i].paste(resized[i], (0, 0), resized[i]), range(len(resized))),
+        1
+    )
+    for radius in [0, 2]:
+        _report(
+            'stage blur -bl {}'.format(radius),
+            _timeit_each(lambda image: image.filter(ImageFilter.GaussianBlur(radius=radius)), backgrounds),
+            1
+        )
+
+    for extension in ['png', 'jpg']:
+        def encode(image):
+            encoded = io.BytesIO()
+            image.convert('RGB').save(encoded, format=Image.registered_extensions()['.' + extension])
+            return encoded.getvalue()
+
+        _report('stage encode -e {}'.format(extension), _timeit_each(encode, backgrounds), 1)
+
+    encoded = [io.BytesIO() for _ in backgrounds]
+    for data, image in zip(encoded, backgrounds):
+        image.convert('RGB').save(data, format='PNG')
+    with tempfile.TemporaryDirectory() as output_dir:
+        def save(i):
+            with open(os.path.join(output_dir, '{}.png'.format(i)), 'wb') as f:
+                f.write(encoded[i].getvalue())
+            with open(os.path.join(output_dir, '{}.gt.txt'.format(i)), 'wb') as f:
+                f.write(strings[i].encode('utf8'))
+
+        _report('stage save', _timeit_each(save, range(len(encoded))), 1)
+
+def _pipeline_configurations(args):
+    """
+        (name, run.py arguments) of the benchmarked pipelines, the default one and
+        variations of one option each, -t is varied by the pool benchmark
+    """
+
+    configurations = [('pipeline default', [])]
+    configurations += [('pipeline -b {}'.format(b), ['-b', str(b)]) for b in [0, 2, 3]]
+    configurations += [('pipeline -d {}'.format(d), ['-d', str(d)]) for d in [1, 2, 3]]
+    configurations += [('pipeline -f {}'.format(f), ['-f', str(f)]) for f in [32, 128] if f != args.format]
+    configurations += [('pipeline -gs', ['-gs']), ('pipeline -b 2 -gs', ['-b', '2', '-gs'])]
+    configurations += [('pipeline -hw', ['-hw'])]
+    return configurations
+
+def bench_pipeline(args):
+    # FakeTextDataGenerator.generate end to end in this process, each line timed on its own
+    fonts = run.load_fonts('hist')
+    lang_dict = run.load_dict('hist')
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        for name, options in _pipeline_configurations(args):
+            run_args = run.parse_arguments(
+                ['--output_dir', output_dir, '-f', str(args.format), '-sd', '0'] + options
+            )
+            try:
+                run.init_worker(fonts, run_args)
+            except ImportError:
+                print('{:<40} skipped, tensorflow is not installed'.format(name))
+                continue
+
+            strings = run.create_strings_from_dict(run_args.length, False, args.count, lang_dict, seed=0)
+            tasks = [(i, s, fonts[i % len(fonts)]) for i, s in enumerate(strings)]
+            _report(name, _timeit_each(FakeTextDataGenerator.generate_from_task, tasks), 1)
+
+def bench_augment(args):
+    # Each augmentation of augment_images.py, with reading and writing the images
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import augment_images
+
+    lines = _sample_lines(args, args.repeat)
+    rng = np.random.default_rng(0)
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        gt_path = os.path.join(output_dir, 'sample.gt.txt')
+        with open(gt_path, 'w', encoding='utf8') as f:
+            f.write(SAMPLE_TEXT)
+        paths = [os.path.join(output_dir, 'line{}.png'.format(i)) for i in range(len(lines))]
+        for path, line in zip(paths, lines):
+            Image.fromarray(np.uint8(line * 255 + 0.5), 'L').save(path)
+
+        _report('augment read', _timeit_each(augment_images.read_image, paths), 1)
+        for name, func in augment_images.AUGMENTATIONS:
+            _report('augment ' + name, _timeit_each(lambda line: func(line, 1.0, rng), lines), 1)
+        _report(
+            'augment save',
+            _timeit_each(lambda line: augment_images.save_augmentation(line, gt_path, output_dir, rng), lines),
+            1
+        )
+
+BENCHMARKS = {
+    'quasicrystal': bench_quasicrystal,
+    'distorsion': bench_distorsion,
+    'warp': bench_warp,
+    'blobs': bench_blobs,
+    'handwritten': bench_handwritten,
+    'pool': bench_pool,
+    'stages': bench_stages,
+    'pipeline': bench_pipeline,
+    'augment': bench_augment,
+}
+
+def _compare(path):
+    """
+        Print the change of the medians against the results in the JSON file path
+    """
+
+    with open(path, 'r', encoding='utf8') as f:
+        previous = {result['name']: result for result in json.load(f)['results']}
+
+    print('\nCompared with ' + path)
+    for result in _results:
+        if result['name'] in previous:
+            before = previous[result['name']]['p50_ms']
+            print('{:<40} median {:9.3f} ms -> {:9.3f} ms   {:+7.1f}%'.format(
+                result['name'], before, result['p50_ms'], (result['p50_ms'] / before - 1) * 100
+            ))
+
+def main():
+    args = parse_arguments()
+
+    benchmarks = []
+    for name in args.benchmarks or BENCHMARKS:
+        if name not in BENCHMARKS:
+            raise ValueError('Unknown benchmark ' + name)
+        start = time.perf_counter()
+        BENCHMARKS[name](args)
+        # The peak is over the whole process so far, the pool benchmark records the peak of its workers
+        benchmarks.append({
+            'name': name,
+            'seconds': time.perf_counter() - start,
+            'peak_rss_mb': _peak_rss_mb(),
+        })
+        print('{:<40} {:9.1f} s   peak RSS {:9.1f} MB'.format(
+            name, benchmarks[-1]['seconds'], benchmarks[-1]['peak_rss_mb']
+        ))
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf8') as f:
+            json.dump({
+                'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'python': platform.python_version(),
+                'numpy': np.__version__,
+                'cpu_count': os.cpu_count(),
+                'arguments': vars(args),
+                'benchmarks': benchmarks,
+                'results': _results,
+            }, f, indent=4)
+    if args.compare:
+        _compare(args.compare)
+
+if __name__ == '__main__':
+    main()
@@ -1,17 +1,115 @@
-import random
+import numpy as np
+
+from functools import lru_cache
 
 from PIL import Image, ImageColor, ImageFont, ImageDraw, ImageFilter
 
-def generate(text, font, text_color, font_size, orientation, space_width, fit):
+from memory_cache import MemoryBoundedCache
+from seeding import get_rng
+
+# Default number of (font, size) pairs kept open per process, see configure_font_cache
+FONT_CACHE_SIZE = 32
+
+# Default memory budget of the rasterized word cache
+WORD_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+_word_cache = MemoryBoundedCache(WORD_CACHE_MAX_BYTES)
+
+def _open_font(font, font_size):
+    """
+        Load a truetype font, parsed TTFs are kept in a per-process LRU cache.
+        Use load_font.cache_info() to get the hit/miss counters.
+    """
+
+    return ImageFont.truetype(font=font, size=font_size)
+
+load_font = lru_cache(maxsize=FONT_CACHE_SIZE)(_open_font)
+
+def configure_font_cache(max_fonts):
+    """
+        Set the number of (font, size) pairs kept open per process, e.g. to the
+        number of fonts of the run so that a random font per line never misses
+    """
+
+    global load_font
+    load_font = lru_cache(maxsize=max_fonts)(_open_font)
+
+def warm_font_cache(fonts, font_size):
+    """
+        Load the given fonts into the cache, e.g. in a Pool worker initializer.
+        Only as many as fit, loading more would just evict the first ones again.
+    """
+
+    for font in fonts[:load_font.cache_info().maxsize]:
+        load_font(font, font_size)
+
+def configure_word_cache(max_bytes):
+    """
+        Set the memory budget of the per-process word cache, 0 disables it.
+        Without the cache every word is drawn with ImageDraw, which is needed
+        if the fill colour has to vary per pixel.
+    """
+
+    global _word_cache
+    _word_cache = MemoryBoundedCache(max_bytes) if max_bytes > 0 else None
+
+def word_cache_info():
+    return _word_cache.info() if _word_cache is not None else None
+
+def _rasterize_word(image_font, font_size, word):
+    """
+        Draw a single word as alpha mask, returns (mask, width, height, x, y)
+        with width and height from getsize and (x, y) the offset of the mask
+        relative to the position the word is drawn at.
+    """
+
+    width, height = image_font.getsize(word)
+
+    # Glyphs may reach outside of the box reported by getsize
+    pad = font_size
+    canvas = Image.new('L', (width + 2 * pad, height + 2 * pad), 0)
+    ImageDraw.Draw(canvas).text((pad, pad), word, fill=255, font=image_font)
+    bbox = canvas.getbbox()
+
+    if bbox is None:
+        return np.zeros((0, 0), dtype=np.uint8), width, height, 0, 0
+
+    return np.array(canvas.crop(bbox)), width, height, bbox[0] - pad, bbox[1] - pad
+
+def _cached_word(image_font, font, font_size, word):
+    return _word_cache.get_or_create(
+        (font, font_size, word),
+        lambda: _rasterize_word(image_font, font_size, word)
+    )
+
+def generate(text, font, text_color, font_size, orientation, space_width, fit, rng=None, grayscale=False):
+    """
+        Draw text as RGBA image, or as LA (gray and alpha) image if grayscale is set
+    """
+
+    rng = get_rng(rng)
     if orientation == 0:
-        return _generate_horizontal_text(text, font, text_color, font_size, space_width, fit)
+        return _generate_horizontal_text(text, font, text_color, font_size, space_width, fit, rng, grayscale)
     elif orientation == 1:
-        return _generate_vertical_text(text, font, text_color, font_size, space_width, fit)
+        return _to_grayscale(_generate_vertical_text(text, font, text_color, font_size, space_width, fit, rng), grayscale)
     else:
         raise ValueError("Unknown orientation " + str(orientation))
 
-def _generate_horizontal_text(text, font, text_color, font_size, space_width, fit):
-    image_font = ImageFont.truetype(font=font, size=font_size)
+def _to_grayscale(txt_img, grayscale):
+    return txt_img.convert('LA') if grayscale else txt_img
+
+def _gray(fill):
+    """
+        The gray value PIL converts the RGB fill colour to
+    """
+
+    return Image.new('RGB', (1, 1), fill).convert('L').getpixel((0, 0))
+
+def _generate_horizontal_text(text, font, text_color, font_size, space_width, fit, rng, grayscale=False):
+    if _word_cache is not None:
+        return _generate_horizontal_text_from_cache(text, font, text_color, font_size, space_width, fit, rng, grayscale)
+
+    image_font = load_font(font, font_size)
     words = text.split(' ')
     space_width = image_font.getsize(' ')[0] * space_width
 
@@ -27,21 +125,78 @@ def _generate_horizontal_text(text, font, text_color, font_size, space_width, fi
     c1, c2 = colors[0], colors[-1]
 
     fill = (
-        random.randint(min(c1[0], c2[0]), max(c1[0], c2[0])),
-        random.randint(min(c1[1], c2[1]), max(c1[1], c2[1])),
-        random.randint(min(c1[2], c2[2]), max(c1[2], c2[2]))
+        int(rng.integers(min(c1[0], c2[0]), max(c1[0], c2[0]), endpoint=True)),
+        int(rng.integers(min(c1[1], c2[1]), max(c1[1], c2[1]), endpoint=True)),
+        int(rng.integers(min(c1[2], c2[2]), max(c1[2], c2[2]), endpoint=True))
     )
 
     for i, w in enumerate(words):
         txt_draw.text((sum(words_width[0:i]) + i * int(space_width), 0), w, fill=fill, font=image_font)
 
+    txt_img = _to_grayscale(txt_img, grayscale)
+
+    if fit:
+        return txt_img.crop(txt_img.getbbox())
+    else:
+        return txt_img
+
+def _generate_horizontal_text_from_cache(text, font, text_color, font_size, space_width, fit, rng, grayscale=False):
+    """
+        Same as _generate_horizontal_text, but the line is put together from
+        cached word masks instead of drawing every word again.
+    """
+
+    image_font = load_font(font, font_size)
+    words = [_cached_word(image_font, font, font_size, w) for w in text.split(' ')]
+    space_width = _cached_word(image_font, font, font_size, ' ')[1] * space_width
+
+    words_width = [w[1] for w in words]
+    text_width =  sum(words_width) + int(space_width) * (len(words) - 1)
+    text_height = max([w[2] for w in words])
+
+    alpha = np.zeros((text_height, text_width), dtype=np.uint8)
+
+    x = 0
+    for mask, width, _, offset_x, offset_y in words:
+        left, top = x + offset_x, offset_y
+        right, bottom = left + mask.shape[1], top + mask.shape[0]
+        # Clip the mask to the line, like ImageDraw does
+        l, t, r, b = max(left, 0), max(top, 0), min(right, text_width), min(bottom, text_height)
+        if l < r and t < b:
+            region = alpha[t:b, l:r]
+            np.maximum(region, mask[t - top:b - top, l - left:r - left], out=region)
+        x += width + int(space_width)
+
+    colors = [ImageColor.getrgb(c) for c in text_color.split(',')]
+    c1, c2 = colors[0], colors[-1]
+
+    fill = (
+        int(rng.integers(min(c1[0], c2[0]), max(c1[0], c2[0]), endpoint=True)),
+        int(rng.integers(min(c1[1], c2[1]), max(c1[1], c2[1]), endpoint=True)),
+        int(rng.integers(min(c1[2], c2[2]), max(c1[2], c2[2]), endpoint=True))
+    )
+
+    if grayscale:
+        # Gray and alpha, half the bytes of RGBA to move through the later stages
+        txt_arr = np.empty((text_height, text_width, 2), dtype=np.uint8)
+        txt_arr[:, :, 0] = np.where(alpha > 0, np.uint8(_gray(fill)), np.uint8(0))
+        txt_arr[:, :, 1] = alpha
+        txt_img = Image.fromarray(txt_arr, 'LA')
+    else:
+        # Build the RGBA pixels as little endian 32 bit words, one pass over the line
+        color = np.array(fill + (0,), dtype=np.uint8).view('<u4')[0]
+        txt_arr = np.where(alpha > 0, color, np.uint32(0)).astype('<u4')
+        txt_arr |= alpha.astype('<u4') << 24
+        txt_arr = txt_arr.view(np.uint8).reshape((text_height, text_width, 4))
+        txt_img = Image.fromarray(txt_arr, 'RGBA')
+
     if fit:
         return txt_img.crop(txt_img.getbbox())
     else:
         return txt_img
 
-def _generate_vertical_text(text, font, text_color, font_size, space_width, fit):
-    image_font = ImageFont.truetype(font=font, size=font_size)
+def _generate_vertical_text(text, font, text_color, font_size, space_width, fit, rng):
+    image_font = load_font(font, font_size)
     
     space_height = int(image_font.getsize(' ')[1] * space_width)
 
@@ -57,9 +212,9 @@ def _generate_vertical_text(text, font, text_color, font_size, space_width, fit)
     c1, c2 = colors[0], colors[-1]
 
     fill = (
-        random.randint(c1[0], c2[0]),
-        random.randint(c1[1], c2[1]),
-        random.randint(c1[2], c2[2])
+        int(rng.integers(c1[0], c2[0], endpoint=True)),
+        int(rng.integers(c1[1], c2[1], endpoint=True)),
+        int(rng.integers(c1[2], c2[2], endpoint=True))
     )
 
     for i, c in enumerate(text):
@@ -1,11 +1,17 @@
+import io
 import os
-import random
+import time
+import uuid
 
 from PIL import Image, ImageFilter
 
 import computer_text_generator
 import background_generator
 import distorsion_generator
+import degrade
+import manifest
+import profiling
+import seeding
 try:
     import handwritten_text_generator
 except ImportError as e:
@@ -13,6 +19,27 @@ except ImportError as e:
 
 
 class FakeTextDataGenerator(object):
+    # Parameters shared by all lines, the seed of the run, the StageProfile and the WritePool, set with configure
+    _config = {}
+    _seed = None
+    _profile = profiling.NO_PROFILE
+    _write_pool = None
+
+    @classmethod
+    def configure(cls, seed=None, profile=None, write_pool=None, **config):
+        """
+            Set the parameters of generate that are the same for every line,
+            e.g. once per worker process. With a seed every line gets its own
+            random generator derived from the seed and its index. With a
+            profiling.StageProfile the stages of every line are timed. With a
+            write_pool.WritePool the lines are encoded and written in its threads.
+        """
+
+        cls._seed = seed
+        cls._profile = profile if profile is not None else profiling.NO_PROFILE
+        cls._write_pool = write_pool
+        cls._config = config
+
     @classmethod
     def generate_from_tuple(cls, t):
         """
@@ -22,8 +49,40 @@ class FakeTextDataGenerator(object):
         cls.generate(*t)
 
     @classmethod
-    def generate(cls, index, text, font, out_dir, size, extension, skewing_angle, random_skew, blur, random_blur, background_type, distorsion_type, distorsion_orientation, is_handwritten, name_format, width, alignment, text_color, orientation, space_width, margins, fit):
+    def generate_from_task(cls, task):
+        """
+            Same as generate, but takes (index, text, font) as one tuple and
+            the other parameters from configure. Returns the manifest record of the line.
+        """
+
+        index, text, font = task
+        return cls.generate(index, text, font, rng=seeding.sample_rng(cls._seed, index), **cls._config)
+
+    @classmethod
+    def generate_from_tasks(cls, tasks):
+        """
+            Same as generate_from_task for a list of tasks, returns the manifest records
+            of the lines. With a write pool they are returned once all lines are written.
+        """
+
+        records = [cls.generate_from_task(task) for task in tasks]
+        if cls._write_pool is None:
+            return records
+
+        records = []
+        for record, laps in cls._write_pool.drain():
+            for stage, seconds in laps:
+                cls._profile.add(stage, seconds)
+            cls._profile.finish()
+            records.append(record)
+        return records
+
+    @classmethod
+    def generate(cls, index, text, font, out_dir, size, extension, skewing_angle, random_skew, blur, random_blur, background_type, distorsion_type, distorsion_orientation, is_handwritten, name_format, width, alignment, text_color, orientation, space_width, margins, fit, writer=None, degradations=None, grayscale=False, rng=None):
         image = None
+        rng = seeding.get_rng(rng)
+        profile = cls._profile
+        profile.start()
 
         margin_top, margin_left, margin_bottom, margin_right = margins
         horizontal_margin = margin_left + margin_right
@@ -35,13 +94,17 @@ class FakeTextDataGenerator(object):
         if is_handwritten:
             if orientation == 1:
                 raise ValueError("Vertical handwritten text is unavailable")
-            image = handwritten_text_generator.generate(text, text_color, fit)
+            image = handwritten_text_generator.generate(text, text_color, fit, rng)
+            if grayscale:
+                image = image.convert('LA')
         else:
-            image = computer_text_generator.generate(text, font, text_color, size, orientation, space_width, fit)
+            image = computer_text_generator.generate(text, font, text_color, size, orientation, space_width, fit, rng, grayscale)
+        profile.lap('render')
 
-        random_angle = random.randint(0-skewing_angle, skewing_angle)
+        random_angle = int(rng.integers(0-skewing_angle, skewing_angle, endpoint=True))
 
         rotated_img = image.rotate(skewing_angle if not random_skew else random_angle, expand=1)
+        profile.lap('skew')
 
         #############################
         # Apply distorsion to image #
@@ -64,8 +127,10 @@ class FakeTextDataGenerator(object):
             distorted_img = distorsion_generator.random(
                 rotated_img,
                 vertical=(distorsion_orientation == 0 or distorsion_orientation == 2),
-                horizontal=(distorsion_orientation == 1 or distorsion_orientation == 2)
+                horizontal=(distorsion_orientation == 1 or distorsion_orientation == 2),
+                rng=rng
             )
+        profile.lap('distortion')
 
         ##################################
         # Resize image to desired format #
@@ -85,18 +150,20 @@ class FakeTextDataGenerator(object):
             background_height = new_height + vertical_margin
         else:
             raise ValueError("Invalid orientation")
+        profile.lap('resize')
 
         #############################
         # Generate background image #
         #############################
         if background_type == 0:
-            background = background_generator.gaussian_noise(background_height, background_width)
+            background = background_generator.gaussian_noise(background_height, background_width, rng, grayscale)
         elif background_type == 1:
-            background = background_generator.plain_white(background_height, background_width)
+            background = background_generator.plain_white(background_height, background_width, grayscale)
         elif background_type == 2:
-            background = background_generator.quasicrystal(background_height, background_width)
+            background = background_generator.quasicrystal(background_height, background_width, rng, grayscale)
         else:
-            background = background_generator.picture(background_height, background_width)
+            background = background_generator.picture(background_height, background_width, rng, grayscale)
+        profile.lap('background')
 
         #############################
         # Place text with alignment #
@@ -110,6 +177,7 @@ class FakeTextDataGenerator(object):
             background.paste(resized_img, (int(background_width / 2 - new_text_width / 2), margin_top), resized_img)
         else:
             background.paste(resized_img, (background_width - new_text_width - margin_right, margin_top), resized_img)
+        profile.lap('paste')
 
         ##################################
         # Apply gaussian blur #
@@ -117,9 +185,18 @@ class FakeTextDataGenerator(object):
 
         final_image = background.filter(
             ImageFilter.GaussianBlur(
-                radius=(blur if not random_blur else random.randint(0, blur))
+                radius=(blur if not random_blur else int(rng.integers(0, blur, endpoint=True)))
             )
         )
+        profile.lap('blur')
+
+        ##################################
+        # Apply ocrodeg degradations #
+        ##################################
+
+        if degradations:
+            final_image = degrade.apply_degradations(final_image, degradations, rng)
+            profile.lap('degrade')
 
         #####################################
         # Generate name for resulting image #
@@ -130,9 +207,54 @@ class FakeTextDataGenerator(object):
             image_name = '{}_{}.{}'.format(str(index), text, extension)
         elif name_format == 2:
             image_name = '{}.{}'.format(str(index),extension)
+        elif name_format == 3:
+            # Unique without renaming afterwards, and still reproducible with a seed
+            image_name = '{}.{}'.format(uuid.UUID(bytes=rng.bytes(16), version=4).hex, extension)
         else:
             print('{} is not a valid name format. Using default.'.format(name_format))
             image_name = '{}_{}.{}'.format(text, str(index), extension)
 
-        # Save the image
-        final_image.convert('RGB').save(os.path.join(out_dir, image_name))
+        # With a write pool the line is written in one of its threads, the record comes from generate_from_tasks
+        if cls._write_pool is not None:
+            cls._write_pool.submit(cls._write, index, image_name, final_image, text.strip(), out_dir, extension, writer, grayscale)
+            # Time spent waiting for a free slot of the pool
+            profile.lap('queue')
+            return None
+
+        record, laps = cls._write(index, image_name, final_image, text.strip(), out_dir, extension, writer, grayscale)
+        for stage, seconds in laps:
+            profile.add(stage, seconds)
+        profile.finish()
+        return record
+
+    @staticmethod
+    def _write(index, image_name, image, text, out_dir, extension, writer, grayscale=False):
+        """
+            Save a finished line (as single channel image with grayscale), returns its
+            manifest record and the (stage, seconds) it took
+        """
+
+        start = time.perf_counter()
+        image = image.convert('L' if grayscale else 'RGB')
+
+        # Hand image and label to the writer, e.g. a ShardWriter or ArrayWriter
+        if writer is not None:
+            record = writer.write(index, image_name, image, text)
+            return record, [('write', time.perf_counter() - start)]
+
+        # Save the image, encoded in memory first for the checksum of the manifest
+        encoded = io.BytesIO()
+        image.save(encoded, format=Image.registered_extensions()['.' + extension.lower()])
+        image_data = encoded.getvalue()
+        encode_end = time.perf_counter()
+        with open(os.path.join(out_dir, image_name), 'wb') as f:
+            f.write(image_data)
+
+        # Save the ground truth for calamari next to it
+        label_data = text.encode('utf8')
+        gt_name = os.path.splitext(image_name)[0] + '.gt.txt'
+        with open(os.path.join(out_dir, gt_name), 'wb') as f:
+            f.write(label_data)
+
+        record = manifest.sample_record(index, image_name, image_data, label_data)
+        return record, [('encode', encode_end - start), ('save', time.perf_counter() - encode_end)]
@@ -0,0 +1,229 @@
+"""
+Degradations for text line images, derived from NVlabs' ocrodeg (https://github.com/NVlabs/ocrodeg).
+All functions work on grayscale float images with values in [0, 1], dark text on a white background.
+They are used by augment_images.py and as optional last stage of FakeTextDataGenerator.generate.
+"""
+
+import math
+
+import cv2
+import numpy as np
+import scipy.ndimage as ndi
+
+from PIL import Image
+from skimage import transform
+
+from memory_cache import MemoryBoundedCache
+from seeding import get_rng
+
+# Coordinate grids of distort_with_noise, lines share one height and only have a few widths
+GRID_CACHE_MAX_BYTES = 32 * 1024 * 1024
+_grid_cache = MemoryBoundedCache(GRID_CACHE_MAX_BYTES)
+
+# Processing dtype and the factor the warp noise field is computed smaller by, see configure
+_dtype = np.float64
+_noise_scale = 1
+
+def configure(float32=False, noise_scale=1):
+    """
+        Set the processing mode of the degradations for this process, float32 halves the memory
+        traffic and noise_scale > 1 computes the warp noise at 1/noise_scale of the resolution
+    """
+
+    global _dtype, _noise_scale
+
+    if noise_scale < 1:
+        raise ValueError('The noise scale has to be at least 1')
+    _dtype = np.float32 if float32 else np.float64
+    _noise_scale = noise_scale
+
+def _coordinate_grid(shape, dtype):
+    """
+        The (2, h, w) identity coordinates for map_coordinates, shared and read only
+    """
+
+    def create():
+        grid = np.indices(shape, dtype=dtype)
+        grid.flags.writeable = False
+        return grid
+
+    return _grid_cache.get_or_create((shape, np.dtype(dtype).str), create)
+
+## copied from ocrodeg's degrade.py to avoid version conflicts:
+
+def bounded_gaussian_noise(shape, sigma, maxdelta, dtype=np.float64, scale=1, rng=None):
+    n, m = shape
+    if scale > 1:
+        # The field is smooth, compute it smaller and interpolate it up (stays within maxdelta)
+        small = bounded_gaussian_noise((-(-n // scale), -(-m // scale)), sigma / scale, maxdelta, dtype, rng=rng)
+        return np.stack([cv2.resize(d, (m, n), interpolation=cv2.INTER_LINEAR) for d in small])
+    deltas = get_rng(rng).random((2, n, m)).astype(dtype, copy=False)
+    deltas = ndi.gaussian_filter(deltas, (0, sigma, sigma))
+    deltas -= np.amin(deltas)
+    deltas /= np.amax(deltas)
+    deltas = (2*deltas-1) * maxdelta
+    return deltas
+
+def distort_with_noise(image, deltas, order=1):
+    assert deltas.shape[0] == 2
+    assert image.shape == deltas.shape[1:], (image.shape, deltas.shape)
+    deltas += _coordinate_grid(image.shape, deltas.dtype)
+    return ndi.map_coordinates(image, deltas, order=order, mode="reflect")
+
+def random_blobs(shape, blobdensity, size, roughness=2.0, rng=None):
+    rng = get_rng(rng)
+    h, w = shape
+    numblobs = int(blobdensity * w * h)
+    mask = np.zeros((h, w), 'i')
+    for i in range(numblobs):
+        mask[rng.integers(0, h), rng.integers(0, w)] = 1
+    return _blobs_from_seeds(mask, size, roughness, rng)
+
+def _blobs_from_seeds(mask, size, roughness, rng):
+    h, w = mask.shape
+    dt = ndi.distance_transform_edt(1-mask)
+    mask =  np.array(dt < size, 'f')
+    mask = ndi.gaussian_filter(mask, size/(2*roughness))
+    mask -= np.amin(mask)
+    mask /= np.amax(mask)
+    noise = rng.random((h, w))
+    noise = ndi.gaussian_filter(noise, size/(2*roughness))
+    noise -= np.amin(noise)
+    noise /= np.amax(noise)
+    return np.array(mask * noise > 0.5, 'f')
+
+def random_blotches(image, fgblobs, bgblobs, fgscale=10, bgscale=10, fast=True, rng=None):
+    rng = get_rng(rng)
+    blobs = random_blobs_fast if fast else random_blobs
+    fg = blobs(image.shape, fgblobs, fgscale, rng=rng)
+    bg = blobs(image.shape, bgblobs, bgscale, rng=rng)
+    return np.minimum(np.maximum(image, fg), 1-bg)
+
+## faster random_blobs for sparse seeds
+
+# Precomputed blobs per (size, roughness), BLOB_STRIP_COUNT strips of BLOB_STRIP_LENGTH blobs each
+BLOB_STRIP_COUNT = 8
+BLOB_STRIP_LENGTH = 64
+# The blobs are the same in every process, so that seeded runs do not depend on the process
+BLOB_STAMP_SEED = 0
+_blob_stamps = {}
+
+def _get_blob_stamps(size, roughness):
+    """
+        (BLOB_STRIP_COUNT, BLOB_STRIP_LENGTH, cell, cell) boolean blobs centered in their cell, cut out of random_blobs run on
+        strips with one seed per cell. The cells are large enough that neighbouring seeds do not
+        influence each other and a strip has about the pixel count of a line, so the noise is
+        normalized like for a line. The strips vary the normalization like different lines do.
+    """
+
+    key = (size, roughness)
+    if key not in _blob_stamps:
+        # The disk of the seed plus the reach of the gaussian filter (truncated at 4 sigma)
+        radius = int(math.ceil(size)) + int(4.0 * size / (2*roughness) + 0.5)
+        cell = 2 * radius + 1
+        seeds = np.zeros((cell, cell * BLOB_STRIP_LENGTH), 'i')
+        seeds[radius, radius::cell] = 1
+        rng = np.random.default_rng(BLOB_STAMP_SEED)
+        strips = [_blobs_from_seeds(seeds, size, roughness, rng) > 0 for _ in range(BLOB_STRIP_COUNT)]
+        _blob_stamps[key] = np.stack([
+            strip.reshape(cell, BLOB_STRIP_LENGTH, cell).transpose(1, 0, 2) for strip in strips
+        ])
+    return _blob_stamps[key]
+
+def random_blobs_fast(shape, blobdensity, size, roughness=2.0, rng=None):
+    """
+        Like random_blobs, but stamps a random precomputed blob (randomly flipped) around every
+        seed instead of filtering the whole image. Overlapping blobs are joined, all blobs of
+        one call come from the same strip.
+    """
+
+    h, w = shape
+    numblobs = int(blobdensity * w * h)
+    mask = np.zeros((h, w), bool)
+    if numblobs == 0:
+        return np.array(mask, 'f')
+
+    rng = get_rng(rng)
+    stamps = _get_blob_stamps(size, roughness)
+    stamps = stamps[rng.integers(stamps.shape[0])]
+    count, cell, _ = stamps.shape
+    radius = cell // 2
+
+    tops = rng.integers(0, h, numblobs) - radius
+    lefts = rng.integers(0, w, numblobs) - radius
+    choices = rng.integers(0, count, numblobs)
+    flips = rng.integers(0, 4, numblobs)
+    for top, left, choice, flip in zip(tops, lefts, choices, flips):
+        y0, y1 = max(top, 0), min(top + cell, h)
+        x0, x1 = max(left, 0), min(left + cell, w)
+        if y0 >= y1 or x0 >= x1:
+            continue
+        stamp = stamps[choice]
+        if flip & 1:
+            stamp = stamp[::-1]
+        if flip & 2:
+            stamp = stamp[:, ::-1]
+        mask[y0:y1, x0:x1] |= stamp[y0-top:y1-top, x0-left:x1-left]
+    return np.array(mask, 'f')
+
+## the augmentations, strength scales the random parameters (1.0 is the default of augment_images.py)
+
+def _fit_height(image, height):
+    """
+        Bring a transformed image back to the given height, larger images are scaled
+        down (so no text is cut off), smaller ones are padded repeating the border
+    """
+
+    if image.shape[0] > height:
+        return transform.resize(image, (height, max(1, int(round(image.shape[1] * height / image.shape[0])))))
+    elif image.shape[0] < height:
+        difference = height - image.shape[0]
+        return np.pad(image, ((difference // 2, difference - difference // 2), (0, 0)), mode='edge')
+    return image
+
+def rescale_and_rotate(image, strength=1.0, rng=None):
+    """
+        Rescale by a random factor and rotate by a small random angle, this changes the image size
+    """
+
+    rng = get_rng(rng)
+    image = transform.rescale(image, rng.uniform(0.8,1.1)*strength)
+    return transform.rotate(image, math.degrees(rng.uniform(-0.02,0.02)*strength), mode='edge')  #rotate btwn -5 and 5 deg
+
+# nice, apply blur, distorsion and some warping -> like real handwritten ink
+# the bigger sigma, the less blurry and distorted the resulting image will be
+def warp(image, strength=1.0, rng=None):
+    rng = get_rng(rng)
+    sigma = rng.uniform(4.0, 8.0)*(1/strength)
+    noise = bounded_gaussian_noise(image.shape, sigma, 5.0, _dtype, _noise_scale, rng)
+    return distort_with_noise(image, noise)
+
+#to blur images a bit, cut out small treshold parts and make the letters look less similar
+def sloppy_blur(image, strength=1.0, rng=None):
+    #blurred_img = ocrodeg.binary_blur(image, np.random.uniform(0.5,3.0))
+    blurred_img = ndi.gaussian_filter(image,get_rng(rng).uniform(0.5,3.0)*strength)
+    return 1.0*(blurred_img>0.5)
+
+def blotches(image, strength=1.0, rng=None):
+    return random_blotches(image, (3e-4)*strength, (1e-4)*strength, rng=rng)
+
+def apply_degradations(image, degradations, rng=None):
+    """
+        Apply degradations to a PIL image, each is a (function, probability, strength)
+        tuple and applied with the given probability. The degradations work in grayscale,
+        a degraded image keeps its mode but loses its colors (and transparency). It has
+        the same height, rescaled images are brought back to it.
+    """
+
+    rng = get_rng(rng)
+    applied = [(function, strength) for function, probability, strength in degradations if rng.random() < probability]
+    if not applied:
+        return image
+
+    image_arr = np.asarray(image.convert('L'), dtype=_dtype) / _dtype(255)
+    height = image_arr.shape[0]
+    for function, strength in applied:
+        image_arr = function(image_arr, strength, rng)
+    image_arr = _fit_height(image_arr, height)
+
+    return Image.fromarray(np.uint8(np.clip(image_arr, 0, 1) * 255 + 0.5), 'L').convert(image.mode)
@@ -6,52 +6,61 @@ import numpy as np
 
 from PIL import Image, ImageDraw, ImageFilter
 
+from seeding import get_rng
+
+def _gather_pixels(pixels, index, valid):
+    """
+        Gather pixels (one uint32 per RGBA or one uint16 per LA pixel) by flat
+        index, pixels that are not valid become transparent
+    """
+
+    # The appended pixel is the transparent one used for invalid positions
+    flat = np.append(pixels.ravel(), np.zeros(1, dtype=pixels.dtype))
+    return np.take(flat, np.where(valid, index, flat.shape[0] - 1))
+
 def _apply_func_distorsion(image, vertical, horizontal, max_offset, func):
     """
-        Apply a distorsion to an image
+        Apply a distorsion to an image, func maps an array of column (or row)
+        positions to their integer offsets
     """
 
     # Nothing to do!
     if not vertical and not horizontal:
         return image
 
-    rgb_image = image.convert('RGBA')
-    
-    img_arr = np.array(rgb_image)
+    # LA images stay LA, everything else is distorted as RGBA
+    mode, word = ('LA', np.uint16) if image.mode == 'LA' else ('RGBA', np.uint32)
+
+    # One word per pixel, so every gather moves whole pixels
+    img_arr = np.array(image.convert(mode)).view(word)[:, :, 0]
+    height, width = img_arr.shape
 
-    vertical_offsets = [func(i) for i in range(img_arr.shape[1])]
-    horizontal_offsets = [
-        func(i)
-        for i in range(
-            img_arr.shape[0] + (
-                (max(vertical_offsets) - min(min(vertical_offsets), 0)) if vertical else 0
+    vertical_offsets = func(np.arange(width))
+    horizontal_offsets = func(
+        np.arange(
+            height + (
+                (vertical_offsets.max() - min(vertical_offsets.min(), 0)) if vertical else 0
             )
         )
-    ]
-
-    new_img_arr = np.zeros((
-                        img_arr.shape[0] + (2 * max_offset if vertical else 0),
-                        img_arr.shape[1] + (2 * max_offset if horizontal else 0),
-                        4
-                    ))
+    )
 
-    new_img_arr_copy = np.copy(new_img_arr)
-    
     if vertical:
-        column_height = img_arr.shape[0]
-        for i, o in enumerate(vertical_offsets):
-            column_pos = (i + max_offset) if horizontal else i
-            new_img_arr[max_offset+o:column_height+max_offset+o, column_pos, :] = img_arr[:, i, :]
+        # Every column is moved down by max_offset + its offset
+        rows = np.arange(height + 2 * max_offset)[:, None] - max_offset - vertical_offsets[None, :]
+        columns = np.arange(width)[None, :]
+        img_arr = _gather_pixels(img_arr, rows * width + columns, (rows >= 0) & (rows < height))
+        height = img_arr.shape[0]
 
     if horizontal:
-        row_width = img_arr.shape[1]
-        for i, o in enumerate(horizontal_offsets):
-            if vertical:
-                new_img_arr_copy[i, max_offset+o:row_width+max_offset+o,:] = new_img_arr[i, max_offset:row_width+max_offset, :]
-            else:
-                new_img_arr[i, max_offset+o:row_width+max_offset+o,:] = img_arr[i, :, :]
+        # Every row is moved right by max_offset + its offset, rows without an
+        # offset stay empty
+        rows = np.arange(horizontal_offsets.shape[0])[:, None]
+        columns = np.arange(width + 2 * max_offset)[None, :] - max_offset - horizontal_offsets[:, None]
+        img_arr = _gather_pixels(img_arr, rows * width + columns, (columns >= 0) & (columns < width))
+        if img_arr.shape[0] < height:
+            img_arr = np.concatenate([img_arr, np.zeros((height - img_arr.shape[0], img_arr.shape[1]), dtype=img_arr.dtype)])
 
-    return Image.fromarray(np.uint8(new_img_arr_copy if horizontal and vertical else new_img_arr)).convert('RGBA')
+    return Image.fromarray(img_arr.view(np.uint8).reshape(img_arr.shape + (len(mode),)), mode)
 
 def sin(image, vertical=False, horizontal=False):
     """
@@ -60,7 +69,7 @@ def sin(image, vertical=False, horizontal=False):
 
     max_offset = int(image.height ** 0.5)
 
-    return _apply_func_distorsion(image, vertical, horizontal, max_offset, (lambda x: int(math.sin(math.radians(x)) * max_offset)))
+    return _apply_func_distorsion(image, vertical, horizontal, max_offset, (lambda x: (np.sin(np.radians(x)) * max_offset).astype(int)))
 
 def cos(image, vertical=False, horizontal=False):
     """
@@ -69,13 +78,14 @@ def cos(image, vertical=False, horizontal=False):
 
     max_offset = int(image.height ** 0.5)
 
-    return _apply_func_distorsion(image, vertical, horizontal, max_offset, (lambda x: int(math.cos(math.radians(x)) * max_offset)))
+    return _apply_func_distorsion(image, vertical, horizontal, max_offset, (lambda x: (np.cos(np.radians(x)) * max_offset).astype(int)))
 
-def random(image, vertical=False, horizontal=False):
+def random(image, vertical=False, horizontal=False, rng=None):
     """
         Apply a random distorsion on one or both of the specified axis
     """
 
+    rng = get_rng(rng)
     max_offset = int(image.height ** 0.4)
 
-    return _apply_func_distorsion(image, vertical, horizontal, max_offset, (lambda x: random.randint(0, max_offset)))
+    return _apply_func_distorsion(image, vertical, horizontal, max_offset, (lambda x: rng.integers(0, max_offset, size=x.shape[0], endpoint=True)))
@@ -9,9 +9,10 @@ from fontTools.ttLib import TTFont
 
 #this function takes the 'labels.txt' file that's created by the TextGenerator and parses the content to the respective 
 #ground-truth-textfile, .gt.txt for calamari training 
-def parse_labels(extension): 
+#the generator now writes the .gt.txt files itself, this is only needed for old labels.txt files 
+def parse_labels(extension, out_dir='out'): 
     path_to_current = os.getcwd() 
-    path_to_labels = os.path.join(path_to_current,'out','labels.txt')
+    path_to_labels = os.path.join(path_to_current,out_dir,'labels.txt')
     
     with open(path_to_labels,'r',encoding='utf8') as textFile: 
         data = textFile.readlines()
@@ -21,7 +22,7 @@ def parse_labels(extension):
             segments[1] = segments[1].strip()
             #print(segments[0]," - ",segments[1])
             
-            path_for_textfile = os.path.join(path_to_current,'out',segments[0]+'.gt.txt')
+            path_for_textfile = os.path.join(path_to_current,out_dir,segments[0]+'.gt.txt')
             txtFile = open(path_for_textfile,'w',encoding='utf8')
             txtFile.write(segments[1]) 
             txtFile.close()            
@@ -1,23 +1,135 @@
 import os
 import pickle
 import numpy as np
-import random
+import sys
+import time
 import tensorflow as tf
-import matplotlib.pyplot as plt
-import matplotlib.cm as cm
-import matplotlib.mlab as mlab
-import seaborn
-from PIL import Image, ImageColor
+from PIL import Image, ImageColor, ImageDraw
 from collections import namedtuple
 
-def _sample(e, mu1, mu2, std1, std2, rho):
-    cov = np.array([[std1 * std1, std1 * std2 * rho],
-                    [std1 * std2 * rho, std2 * std2]])
-    mean = np.array([mu1, mu2])
+from seeding import get_rng
 
-    x, y = np.random.multivariate_normal(mean, cov)
-    end = np.random.binomial(1, e)
-    return np.array([x, y, end])
+PARAM_FIELDS = ['coordinates', 'sequence', 'bias', 'e', 'pi', 'mu1', 'mu2', 'std1', 'std2',
+                'rho', 'window', 'kappa', 'phi', 'finish', 'zero_states']
+
+Model = namedtuple('Model', ['session', 'params', 'translation', 'step', 'state_sizes'])
+
+# Most words of the same length sampled together in one batch
+BATCH_SIZE = 32
+
+# The model of this process, loaded on first use by _get_model
+_model = None
+
+# Height the lines are drawn at (the generator scales them to the requested one) and the
+# space between words relative to it
+LINE_HEIGHT = 128
+WORD_SPACING = 0.3
+
+# Stroke width in pixels at LINE_HEIGHT and the supersampling factor used for anti-aliasing, see configure
+_stroke_width = 4
+_supersampling = 4
+
+# Seconds this process spent loading the model and sampling and rendering words
+timings = {'load': 0.0, 'sample': 0.0, 'render': 0.0, 'words': 0, 'lines': 0}
+
+def _get_model():
+    """
+        Load the model on first use, its graph and session are kept for all lines of this process
+    """
+
+    global _model
+
+    if _model is None:
+        start = time.perf_counter()
+        with open(os.path.join('handwritten_model', 'translation.pkl'), 'rb') as file:
+            translation = pickle.load(file)
+
+        config = tf.ConfigProto(
+            device_count={'GPU': 0}
+        )
+        meta_graph = tf.MetaGraphDef()
+        with open(os.path.join('handwritten_model', 'model-29.meta'), 'rb') as file:
+            meta_graph.ParseFromString(file.read())
+        nodes = {node.name: node for node in meta_graph.graph_def.node}
+
+        # The sampling graph (model_1) keeps its recurrent state in variables of batch size 1, the
+        # final state of a step is assigned to them before the prediction. The reads of the variables
+        # are replaced by placeholders of any batch size and the final states are fetched instead,
+        # so that the state lives in numpy and many words step through the network together.
+        state_assigns = [
+            node for node in meta_graph.graph_def.node
+            if node.op == 'Assign' and node.name.startswith('model_1/') and node.input[1].startswith('model_1/rnn_1/while/Exit')
+        ]
+        state_sizes = [nodes[assign.input[0]].attr['shape'].shape.dim[1].size for assign in state_assigns]
+
+        graph = tf.Graph()
+        with graph.as_default():
+            session = tf.Session(config=config, graph=graph)
+            states = [tf.placeholder(tf.float32, [None, size]) for size in state_sizes]
+            no_assign = tf.constant(0.)
+            input_map = {}
+            for assign, state in zip(state_assigns, states):
+                input_map[assign.input[0] + '/read:0'] = state
+                input_map['^' + assign.name] = no_assign
+            saver = tf.train.import_meta_graph(meta_graph, input_map=input_map)
+            saver.restore(session, 'handwritten_model/model-29')
+            params = namedtuple('Params', PARAM_FIELDS)(
+                *[graph.get_collection(name)[0] for name in PARAM_FIELDS]
+            )
+            final_states = [graph.get_tensor_by_name(assign.input[1] + ':0') for assign in state_assigns]
+
+            # One network step, fetching only what the sampling needs and the next state
+            step = session.make_callable(
+                [params.e, params.pi, params.mu1, params.mu2, params.std1, params.std2, params.rho, params.finish] + final_states,
+                [params.coordinates, params.sequence, params.bias] + states
+            )
+
+        _model = Model(session, params, translation, step, state_sizes)
+        timings['load'] += time.perf_counter() - start
+    return _model
+
+def configure(stroke_width=4, supersampling=4):
+    """
+        Set the stroke width (in pixels at LINE_HEIGHT) and the anti-aliasing of the strokes for
+        this process, the strokes are drawn supersampling times larger and scaled down (1 disables it)
+    """
+
+    global _stroke_width, _supersampling
+
+    if stroke_width < 1 or supersampling < 1:
+        raise ValueError('The stroke width and the supersampling have to be at least 1')
+    _stroke_width = stroke_width
+    _supersampling = supersampling
+
+def print_timings():
+    """
+        Print the time spent loading the model separately from the time spent per line
+    """
+
+    if timings['lines'] == 0:
+        return
+    print('handwriting (pid {}): model loaded in {:.2f} s, {} lines / {} words sampled in {:.2f} s and rendered in {:.2f} s ({:.1f} ms per word)'.format(
+        os.getpid(), timings['load'], timings['lines'], timings['words'], timings['sample'], timings['render'],
+        1000 * (timings['sample'] + timings['render']) / max(timings['words'], 1)
+    ), file=sys.stderr)
+
+def _sample_mixture(e, pi, mu1, mu2, std1, std2, rho, rng):
+    """
+        Sample the next point of every row of a batch: pick a mixture component by pi, draw
+        from its bivariate normal and draw the end of stroke flag. Returns (batch, 3)
+    """
+
+    batch = pi.shape[0]
+    rows = np.arange(batch)
+    # min() guards against the cumulative sum of pi rounding to slightly below 1
+    g = np.minimum((rng.random((batch, 1)) > np.cumsum(pi, axis=1)).sum(axis=1), pi.shape[1] - 1)
+    mu1, mu2, std1, std2, rho = [v[rows, g] for v in (mu1, mu2, std1, std2, rho)]
+
+    z1, z2 = rng.standard_normal((2, batch))
+    x = mu1 + std1 * z1
+    y = mu2 + std2 * (rho * z1 + np.sqrt(1 - rho * rho) * z2)
+    end = rng.random(batch) < e[:, 0]
+    return np.stack([x, y, end], axis=1)
 
 
 def _split_strokes(points):
@@ -36,123 +148,146 @@ def _cumsum(points):
     return np.concatenate([sums, points[:, 2:]], axis=1)
 
 
-def _sample_text(sess, args_text, translation):
-    # Original creator said it helps (https://github.com/Grzego/handwriting-generation/issues/3)
-    args_text += ' '
+def _sample_batch(model, texts, rng):
+    """
+        Sample the strokes of texts of the same length together, one network step for all of
+        them. Finished texts are dropped from the batch, the others step on. Returns the
+        coordinates of every text.
+    """
 
-    fields = ['coordinates', 'sequence', 'bias', 'e', 'pi', 'mu1', 'mu2', 'std1', 'std2',
-                'rho', 'window', 'kappa', 'phi', 'finish', 'zero_states']
-    vs = namedtuple('Params', fields)(
-        *[tf.get_collection(name)[0] for name in fields]
-    )
-
-    text = np.array([translation.get(c, 0) for c in args_text])
-    sequence = np.eye(len(translation), dtype=np.float32)[text]
-    sequence = np.expand_dims(np.concatenate([sequence, np.zeros((1, len(translation)))]), axis=0)
-
-    coord = np.array([0., 0., 1.])
-    coords = [coord]
-
-    phi_data, window_data, kappa_data, stroke_data = [], [], [], []
-    sess.run(vs.zero_states)
-    for s in range(1, 60 * len(args_text) + 1):
-        e, pi, mu1, mu2, std1, std2, rho, \
-        finish, phi, window, kappa = sess.run([vs.e, vs.pi, vs.mu1, vs.mu2,
-                                                vs.std1, vs.std2, vs.rho, vs.finish,
-                                                vs.phi, vs.window, vs.kappa],
-                                                feed_dict={
-                                                    vs.coordinates: coord[None, None, ...],
-                                                    vs.sequence: sequence,
-                                                    vs.bias: 1.
-                                                })
-        phi_data += [phi[0, :]]
-        window_data += [window[0, :]]
-        kappa_data += [kappa[0, :]]
-        # ---
-        g = np.random.choice(np.arange(pi.shape[1]), p=pi[0])
-        coord = _sample(e[0, 0], mu1[0, g], mu2[0, g],
-                        std1[0, g], std2[0, g], rho[0, g])
-        coords += [coord]
-        stroke_data += [[mu1[0, g], mu2[0, g], std1[0, g], std2[0, g], rho[0, g], coord[2]]]
-
-        if finish[0, 0] > 0.8:
+    # Original creator said it helps (https://github.com/Grzego/handwriting-generation/issues/3)
+    texts = [text + ' ' for text in texts]
+    count = len(texts)
+
+    translation = model.translation
+    characters = np.eye(len(translation), dtype=np.float32)
+    # One hot characters followed by an empty one
+    sequence = np.zeros((count, len(texts[0]) + 1, len(translation)), dtype=np.float32)
+    for b, text in enumerate(texts):
+        sequence[b, :-1] = characters[[translation.get(c, 0) for c in text]]
+
+    coord = np.zeros((count, 1, 3), dtype=np.float32)
+    coord[:, 0, 2] = 1.
+    states = [np.zeros((count, size), dtype=np.float32) for size in model.state_sizes]
+
+    # The points of every text, active are the rows of the batch that are not finished yet
+    points = [[coord[b, 0].copy()] for b in range(count)]
+    active = np.arange(count)
+    for _ in range(60 * len(texts[0])):
+        outputs = model.step(coord, sequence, 1., *states)
+        e, pi, mu1, mu2, std1, std2, rho, finish = outputs[:8]
+        sampled = _sample_mixture(e, pi, mu1, mu2, std1, std2, rho, rng)
+        for b, point in zip(active, sampled):
+            points[b].append(point)
+
+        # A text ends with the point sampled when it finished
+        running = finish[:, 0] <= 0.8
+        if not running.any():
             break
-
-    coords = np.array(coords)
-    coords[-1, 2] = 1.
-
-    return phi_data, window_data, kappa_data, stroke_data, coords
-
-def _crop_white_borders(image):
-    image_data = np.asarray(image)
-    grey_image_data = np.asarray(image.convert('L'))
-    non_empty_columns = np.where(grey_image_data.min(axis=0) < 255)[0]
-    non_empty_rows = np.where(grey_image_data.min(axis=1) < 255)[0]
-    cropBox = (min(non_empty_rows), max(non_empty_rows), min(non_empty_columns), max(non_empty_columns))
-    image_data_new = image_data[cropBox[0]:cropBox[1]+1, cropBox[2]:cropBox[3]+1, :]
-
-    return Image.fromarray(image_data_new)
-
-def _join_images(images):
-    widths, heights = zip(*(i.size for i in images))
-
-    total_width = sum(widths) - 35 * len(images)
-    max_height = max(heights)
-
-    compound_image = Image.new('RGBA', (total_width, max_height))
-
-    x_offset = 0
-    for im in images:
-        compound_image.paste(im, (x_offset,0))
-        x_offset += (im.size[0] - 35)
-
-    return compound_image
-
-def generate(text, text_color):
-    with open(os.path.join('handwritten_model', 'translation.pkl'), 'rb') as file:
-        translation = pickle.load(file)
-
-    config = tf.ConfigProto(
-        device_count={'GPU': 0}
+        active = active[running]
+        coord = sampled[running, np.newaxis].astype(np.float32)
+        sequence = sequence[running]
+        states = [state[running] for state in outputs[8:]]
+
+    result = []
+    for text_points in points:
+        text_coords = np.array(text_points)
+        text_coords[-1, 2] = 1.
+        result.append(text_coords)
+    return result
+
+def _sample_words(model, words, rng):
+    """
+        Sample the strokes of all words, returns their coordinates in the same order. Words of
+        the same length are sampled together, the model can only take batches of them as the
+        window of finished words would move on over the padding of longer ones.
+    """
+
+    buckets = {}
+    for i, word in enumerate(words):
+        buckets.setdefault(len(word), []).append(i)
+
+    coords = [None] * len(words)
+    for indices in buckets.values():
+        for start in range(0, len(indices), BATCH_SIZE):
+            batch = indices[start:start + BATCH_SIZE]
+            for i, word_coords in zip(batch, _sample_batch(model, [words[i] for i in batch], rng)):
+                coords[i] = word_coords
+    return coords
+
+def _render_strokes(word_strokes, color):
+    """
+        Draw the strokes of the words of a line next to each other, with one scale for the whole
+        line, into an RGBA image fitting them
+    """
+
+    # Single points are the pen moving to the start and are not drawn
+    word_strokes = [[stroke for stroke in strokes if len(stroke) > 1] for strokes in word_strokes]
+    points = [np.concatenate(strokes) for strokes in word_strokes if strokes]
+    if not points:
+        return Image.new('RGBA', (1, 1))
+
+    # The y axis of the samples points up, all words start at the same height
+    all_points = np.concatenate(points)
+    top, bottom = -all_points[:, 1].max(), -all_points[:, 1].min()
+    scale = LINE_HEIGHT / max(bottom - top, 1e-6)
+    padding = _stroke_width
+
+    offsets = []
+    x = padding
+    for strokes in word_strokes:
+        if not strokes:
+            offsets.append(None)
+            continue
+        word_points = np.concatenate(strokes)
+        offsets.append(x - word_points[:, 0].min() * scale)
+        x += (word_points[:, 0].max() - word_points[:, 0].min()) * scale + WORD_SPACING * LINE_HEIGHT
+    width = int(np.ceil(x - WORD_SPACING * LINE_HEIGHT + padding))
+    height = LINE_HEIGHT + 2 * padding
+
+    ss = _supersampling
+    mask = Image.new('L', (width * ss, height * ss), 0)
+    draw = ImageDraw.Draw(mask)
+    for strokes, offset in zip(word_strokes, offsets):
+        for stroke in strokes:
+            xy = np.empty(stroke.shape)
+            xy[:, 0] = (stroke[:, 0] * scale + offset) * ss
+            xy[:, 1] = ((-stroke[:, 1] - top) * scale + padding) * ss
+            draw.line([tuple(p) for p in xy], fill=255, width=_stroke_width * ss, joint='curve')
+    if ss > 1:
+        mask = mask.resize((width, height), Image.BOX)
+    mask = mask.crop(mask.getbbox())
+
+    image = Image.new('RGBA', mask.size, color)
+    image.putalpha(mask)
+    return image
+
+def generate(text, text_color, fit=False, rng=None):
+    """
+        Write text with the RNN, the image is always cropped to the strokes (fit is implied)
+    """
+
+    rng = get_rng(rng)
+    model = _get_model()
+
+    colors = [ImageColor.getrgb(c) for c in text_color.split(',')]
+    c1, c2 = colors[0], colors[-1]
+
+    color = '#{:02x}{:02x}{:02x}'.format(
+        int(rng.integers(min(c1[0], c2[0]), max(c1[0], c2[0]), endpoint=True)),
+        int(rng.integers(min(c1[1], c2[1]), max(c1[1], c2[1]), endpoint=True)),
+        int(rng.integers(min(c1[2], c2[2]), max(c1[2], c2[2]), endpoint=True))
     )
-    tf.reset_default_graph()
-    with tf.Session(config=config) as sess:
-        saver = tf.train.import_meta_graph('handwritten_model/model-29.meta')
-        saver.restore(sess, 'handwritten_model/model-29')
-        images = []
-        colors = [ImageColor.getrgb(c) for c in text_color.split(',')]
-        c1, c2 = colors[0], colors[-1]
-
-        color = '#{:02x}{:02x}{:02x}'.format(
-            random.randint(min(c1[0], c2[0]), max(c1[0], c2[0])),
-            random.randint(min(c1[1], c2[1]), max(c1[1], c2[1])),
-            random.randint(min(c1[2], c2[2]), max(c1[2], c2[2]))
-        )
-
-        for word in text.split(' '):
-            _, window_data, kappa_data, stroke_data, coords = _sample_text(sess, word, translation)
-
-            strokes = np.array(stroke_data)
-            strokes[:, :2] = np.cumsum(strokes[:, :2], axis=0)
-            _, maxx = np.min(strokes[:, 0]), np.max(strokes[:, 0])
-            miny, maxy = np.min(strokes[:, 1]), np.max(strokes[:, 1])
-
-            fig, ax = plt.subplots(1, 1)
-            fig.patch.set_visible(False)
-            ax.axis('off')
-
-            for stroke in _split_strokes(_cumsum(np.array(coords))):
-                plt.plot(stroke[:, 0], -stroke[:, 1], color=color)
-
-            fig.patch.set_alpha(0)
-            fig.patch.set_facecolor('none')
-
-            canvas = plt.get_current_fig_manager().canvas
-            canvas.draw()
 
-            image = Image.frombytes('RGBA', canvas.get_width_height(), canvas.buffer_rgba())
-            images.append(_crop_white_borders(image))
+    start = time.perf_counter()
+    words = text.split(' ')
+    word_coords = _sample_words(model, words, rng)
+    sampled = time.perf_counter()
 
-            plt.close()
+    image = _render_strokes([_split_strokes(_cumsum(coords)) for coords in word_coords], color)
 
-        return _join_images(images)
+    timings['sample'] += sampled - start
+    timings['render'] += time.perf_counter() - sampled
+    timings['words'] += len(words)
+    timings['lines'] += 1
+    return image
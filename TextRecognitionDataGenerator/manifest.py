@@ -0,0 +1,172 @@
+"""
+Manifests of generated datasets. Every run writes into its output directory
+
+    manifest.jsonl   one JSON record per generated line: index, image name, sizes and sha256
+                     checksums of image and label, and the location in tar or array output.
+                     Appended by the parent as the lines are done, a resumed run skips the
+                     indices recorded in it.
+    manifest.json    summary of the run: the index range, the number of lines, the arguments
+                     and the checksum of manifest.jsonl
+
+A line that a writer did not write (e.g. a too wide line of the array output) has a record with
+its index and the reason in 'skipped' instead of the checksums.
+
+merge_manifests combines the manifests of several runs, e.g. the shards of one dataset
+generated on different machines, without reading any image.
+"""
+
+import hashlib
+import json
+import os
+
+MANIFEST_NAME = 'manifest.json'
+RECORDS_NAME = 'manifest.jsonl'
+
+def sample_record(index, image_name, image_data, label_data, **location):
+    """
+        The manifest record of one line, image_data and label_data are the bytes as written
+    """
+
+    record = {
+        'index': index,
+        'image': image_name,
+        'image_size': len(image_data),
+        'image_sha256': hashlib.sha256(image_data).hexdigest(),
+        'label_size': len(label_data),
+        'label_sha256': hashlib.sha256(label_data).hexdigest(),
+    }
+    record.update(location)
+    return record
+
+def file_sha256(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+class RecordLog(object):
+    """
+        Appends the records of the generated lines to manifest.jsonl in out_dir, one line per
+        record, written through so that the log is complete up to the last finished line
+    """
+
+    def __init__(self, out_dir, append=False):
+        self.path = os.path.join(out_dir, RECORDS_NAME)
+        self.count = 0
+        self._file = open(self.path, 'a' if append else 'w', encoding='utf8', buffering=1)
+
+    def write(self, record):
+        self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self.count += 1
+
+    def close(self):
+        self._file.close()
+
+def completed_indices(out_dir):
+    """
+        The indices recorded in manifest.jsonl of out_dir, to resume a run that was interrupted.
+        A record that was cut off at the end is removed, so that the log can be appended to.
+    """
+
+    path = os.path.join(out_dir, RECORDS_NAME)
+    if not os.path.exists(path):
+        return set()
+
+    indices = set()
+    complete_size = 0
+    with open(path, 'rb') as f:
+        for line in f:
+            if not line.endswith(b'\n'):
+                break
+            indices.add(json.loads(line)['index'])
+            complete_size += len(line)
+    if complete_size < os.path.getsize(path):
+        with open(path, 'rb+') as f:
+            f.truncate(complete_size)
+    return indices
+
+def write_manifest(out_dir, summary):
+    """
+        Write manifest.json, summary (with start_index and end_index) is completed with the number
+        of records, how many of them were skipped, the number of indices in the range without
+        one and the checksum of manifest.jsonl
+    """
+
+    records_path = os.path.join(out_dir, RECORDS_NAME)
+    count = 0
+    skipped = 0
+    with open(records_path, 'r', encoding='utf8') as f:
+        for line in f:
+            count += 1
+            skipped += 'skipped' in json.loads(line)
+
+    manifest = dict(summary)
+    manifest['count'] = count
+    manifest['skipped'] = skipped
+    manifest['missing'] = manifest['end_index'] - manifest['start_index'] - count
+    manifest['records'] = RECORDS_NAME
+    manifest['records_sha256'] = file_sha256(records_path)
+
+    with open(os.path.join(out_dir, MANIFEST_NAME), 'w', encoding='utf8') as f:
+        json.dump(manifest, f, indent=4, ensure_ascii=False)
+    return manifest
+
+def read_manifest(directory):
+    """
+        Read manifest.json of a run, checking that manifest.jsonl was not changed since
+    """
+
+    with open(os.path.join(directory, MANIFEST_NAME), 'r', encoding='utf8') as f:
+        manifest = json.load(f)
+    if file_sha256(os.path.join(directory, manifest['records'])) != manifest['records_sha256']:
+        raise ValueError('The records of {} do not match the checksum of its manifest'.format(directory))
+    return manifest
+
+def merge_manifests(directories, out_dir):
+    """
+        Combine the manifests of the runs in directories into one in out_dir. The images stay where
+        they are, every record gets the directory of its run relative to out_dir. The records are
+        grouped by run, in the order of the index ranges. Fails if the index ranges overlap.
+    """
+
+    runs = sorted(((read_manifest(d), d) for d in directories), key=lambda run: run[0]['start_index'])
+
+    for (previous, previous_dir), (manifest, directory) in zip(runs, runs[1:]):
+        if manifest['start_index'] < previous['end_index']:
+            raise ValueError('The indices of {} and {} overlap ([{}, {}) and [{}, {}))'.format(
+                previous_dir, directory,
+                previous['start_index'], previous['end_index'], manifest['start_index'], manifest['end_index']
+            ))
+    seeds = set(manifest.get('seed') for manifest, _ in runs)
+    if len(seeds) > 1:
+        print('Warning: the runs were generated with different seeds ({})'.format(', '.join(map(str, seeds))))
+
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+
+    summary_runs = []
+    with open(os.path.join(out_dir, RECORDS_NAME), 'w', encoding='utf8') as out:
+        for manifest, directory in runs:
+            relative = os.path.relpath(directory, out_dir)
+            with open(os.path.join(directory, manifest['records']), 'r', encoding='utf8') as f:
+                for line in f:
+                    record = json.loads(line)
+                    record['directory'] = relative
+                    out.write(json.dumps(record, ensure_ascii=False) + '\n')
+            summary_runs.append({
+                'directory': relative,
+                'start_index': manifest['start_index'],
+                'end_index': manifest['end_index'],
+                'count': manifest['count'],
+                'records_sha256': manifest['records_sha256'],
+            })
+
+    start_index = runs[0][0]['start_index'] if runs else 0
+    end_index = max(manifest['end_index'] for manifest, _ in runs) if runs else 0
+    return write_manifest(out_dir, {
+        'start_index': start_index,
+        'end_index': end_index,
+        'seed': seeds.pop() if len(seeds) == 1 else None,
+        'runs': summary_runs,
+    })
@@ -0,0 +1,39 @@
+"""
+Combine the manifests of several runs, e.g. the shards of one dataset generated on different
+machines with --shard_index/--num_shards, into one manifest. Only the manifests are read, e.g.
+
+    python merge_manifests.py -o dataset node0/out node1/out node2/out
+"""
+
+import argparse
+
+from manifest import merge_manifests
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Merge the manifests of several runs without touching the images.')
+    parser.add_argument(
+        "directories",
+        type=str,
+        nargs="+",
+        help="The output directories of the runs",
+    )
+    parser.add_argument(
+        "-o",
+        "--output_dir",
+        type=str,
+        nargs="?",
+        help="The directory the merged manifest is written to",
+        default="."
+    )
+    return parser.parse_args()
+
+def main():
+    args = parse_arguments()
+
+    merged = merge_manifests(args.directories, args.output_dir)
+    print('Merged {} runs: {} lines with indices in [{}, {}), {} missing'.format(
+        len(merged['runs']), merged['count'], merged['start_index'], merged['end_index'], merged['missing']
+    ))
+
+if __name__ == '__main__':
+    main()
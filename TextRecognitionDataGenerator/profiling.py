@@ -0,0 +1,157 @@
+"""
+Optional timing of the stages of FakeTextDataGenerator.generate (run.py --profile). Every worker
+collects the durations of its lines in a StageProfile and hands it to the parent when it exits.
+The durations are counted in fixed histogram bins, so the profiles of all workers add up.
+"""
+
+import bisect
+import os
+import time
+
+# The stages in the order generate passes them, encode and save are one 'write' with a writer.
+# With a write pool they run in its threads and queue is the wait for a free slot.
+STAGES = ['render', 'skew', 'distortion', 'resize', 'background', 'paste', 'blur', 'degrade', 'queue', 'encode', 'save', 'write']
+
+# Histogram bin edges in seconds, 20 per decade from 1 µs to 100 s
+BIN_EDGES = [10 ** (e / 20) for e in range(-120, 41)]
+
+class StageProfile(object):
+    """
+        Stage durations and throughput of the lines generated by one process
+    """
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self.samples = 0
+        self.counts = {}
+        self.totals = {}
+        # perf_counter at the start of the first and the end of the last line
+        self.first = None
+        self.last = None
+        self._lap_start = None
+
+    def start(self):
+        """
+            Start timing a line
+        """
+
+        self._lap_start = time.perf_counter()
+        if self.first is None:
+            self.first = self._lap_start
+
+    def lap(self, stage):
+        """
+            Count the time since the start or the last lap to stage
+        """
+
+        now = time.perf_counter()
+        self.add(stage, now - self._lap_start)
+        self._lap_start = now
+
+    def finish(self):
+        """
+            The line is written
+        """
+
+        self.samples += 1
+        self.last = time.perf_counter()
+
+    def add(self, stage, seconds):
+        if stage not in self.counts:
+            self.counts[stage] = [0] * (len(BIN_EDGES) + 1)
+            self.totals[stage] = 0.0
+        self.counts[stage][bisect.bisect_left(BIN_EDGES, seconds)] += 1
+        self.totals[stage] += seconds
+
+    def wall_seconds(self):
+        return self.last - self.first if self.samples else 0.0
+
+class _NoProfile(object):
+    """
+        Stands in for a StageProfile when profiling is off
+    """
+
+    def start(self):
+        pass
+
+    def lap(self, stage):
+        pass
+
+    def finish(self):
+        pass
+
+    def add(self, stage, seconds):
+        pass
+
+NO_PROFILE = _NoProfile()
+
+def _percentile(counts, q):
+    """
+        Upper edge of the bin holding the q-th percentile, in seconds
+    """
+
+    rank = q / 100 * sum(counts)
+    seen = 0
+    for i, count in enumerate(counts):
+        seen += count
+        if count and seen >= rank:
+            return BIN_EDGES[min(i, len(BIN_EDGES) - 1)]
+    return 0.0
+
+def summary(profiles):
+    """
+        The added up stage histograms and the throughput of every worker as a JSON compatible dict.
+        Percentiles are the upper edges of their histogram bins (about 12% resolution).
+    """
+
+    counts = {}
+    totals = {}
+    for profile in profiles:
+        for stage, stage_counts in profile.counts.items():
+            counts[stage] = [a + b for a, b in zip(counts.get(stage, [0] * len(stage_counts)), stage_counts)]
+            totals[stage] = totals.get(stage, 0.0) + profile.totals[stage]
+
+    total = sum(totals.values())
+    stages = {}
+    for stage in sorted(counts, key=STAGES.index):
+        count = sum(counts[stage])
+        stages[stage] = {
+            'count': count,
+            'total_seconds': totals[stage],
+            'share': totals[stage] / total if total else 0.0,
+            'mean_ms': totals[stage] / count * 1000,
+            'p50_ms': _percentile(counts[stage], 50) * 1000,
+            'p90_ms': _percentile(counts[stage], 90) * 1000,
+            'p99_ms': _percentile(counts[stage], 99) * 1000,
+            'histogram': counts[stage],
+        }
+
+    workers = []
+    for profile in sorted(profiles, key=lambda profile: profile.pid):
+        wall = profile.wall_seconds()
+        workers.append({
+            'pid': profile.pid,
+            'lines': profile.samples,
+            'seconds': wall,
+            'lines_per_second': profile.samples / wall if wall else 0.0,
+            # Above 100% if write threads overlap with the rendering
+            'busy': sum(profile.totals.values()) / wall if wall else 0.0,
+        })
+
+    return {'bin_edges_seconds': BIN_EDGES, 'stages': stages, 'workers': workers}
+
+def print_summary(summary):
+    print('\n{:<12} {:>9} {:>7} {:>11} {:>11} {:>11} {:>11}'.format(
+        'stage', 'lines', 'share', 'mean ms', 'p50 ms', 'p90 ms', 'p99 ms'
+    ))
+    for stage, values in summary['stages'].items():
+        print('{:<12} {:>9} {:>6.1f}% {:>11.3f} {:>11.3f} {:>11.3f} {:>11.3f}'.format(
+            stage, values['count'], values['share'] * 100,
+            values['mean_ms'], values['p50_ms'], values['p90_ms'], values['p99_ms']
+        ))
+
+    print('\n{:<12} {:>9} {:>9} {:>11} {:>7}'.format('worker', 'lines', 'seconds', 'lines/s', 'busy'))
+    for worker in summary['workers']:
+        print('{:<12} {:>9} {:>9.1f} {:>11.1f} {:>6.1f}%'.format(
+            worker['pid'], worker['lines'], worker['seconds'], worker['lines_per_second'], worker['busy'] * 100
+        ))
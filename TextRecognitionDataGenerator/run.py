@@ -1,6 +1,8 @@
 import argparse
+import itertools
+import json
 import os, errno
-import random
+import queue
 import string
 import math
 import uuid
@@ -12,17 +14,188 @@ from fontTools.ttLib import TTFont
 import matplotlib.pyplot as plt 
 import matplotlib.font_manager as mfm
 
-import file_parser
+import computer_text_generator
+import background_generator
+import degrade
+import seeding
+import manifest
+import profiling
 
 from tqdm import tqdm
 from string_generator import (
     create_strings_from_dict,
     create_strings_from_file,
     create_strings_from_wikipedia,
-    create_strings_randomly
+    create_strings_randomly,
+    iter_strings_from_dict,
+    iter_strings_from_file,
+    iter_strings_from_wikipedia,
+    iter_strings_randomly
 )
 from data_generator import FakeTextDataGenerator
-from multiprocessing import Pool
+from multiprocessing import Pool, Queue, util
+from shard_writer import ShardWriter
+from write_pool import WritePool
+import array_writer
+
+def index_range(args):
+    """
+        The indices [begin, end) of the lines generated by this run: its part of the -c lines
+        starting at -st, when they are split into -nsh parts
+    """
+
+    if not 0 <= args.shard_index < args.num_shards:
+        raise ValueError('The shard index has to be in [0, {})'.format(args.num_shards))
+    begin = args.start_index + args.count * args.shard_index // args.num_shards
+    end = args.start_index + args.count * (args.shard_index + 1) // args.num_shards
+    return begin, end
+
+def init_worker(fonts, args, profiles=None):
+    """
+        Pool initializer, receives the generation parameters once per worker
+        process, loads the fonts and sets up the per-worker caches. With a
+        profiles queue the worker times its lines and puts its StageProfile
+        into the queue when it exits. It must not fail, the pool would start
+        new workers forever: the arguments are checked by parse_arguments.
+    """
+
+    # One size per run, so every font of the run fits unless the cache is set smaller
+    computer_text_generator.configure_font_cache(args.font_cache if args.font_cache > 0 else len(fonts))
+    computer_text_generator.warm_font_cache(fonts, args.format)
+    computer_text_generator.configure_word_cache(args.word_cache * 1024 * 1024)
+    background_generator.configure_picture_pool(args.picture_pool * 1024 * 1024, args.picture_width_step)
+    background_generator.configure_background_cache(args.background_cache * 1024 * 1024)
+
+    if args.handwritten:
+        import handwritten_text_generator
+        # The model is loaded once per worker, its load and sampling times are printed when the worker exits
+        util.Finalize(None, handwritten_text_generator.print_timings, exitpriority=0)
+        handwritten_text_generator.configure(args.handwritten_stroke_width, args.handwritten_supersampling)
+
+    writer = None
+    if args.output_format == 'tar':
+        writer = ShardWriter(args.output_dir, args.shard_size * 1024 * 1024)
+        # Closes the last shard when the worker exits
+        util.Finalize(writer, writer.close, exitpriority=10)
+    elif args.output_format == 'array':
+        writer = array_writer.ArrayWriter(args.output_dir, args.max_width)
+        util.Finalize(writer, writer.close, exitpriority=10)
+
+    # Applied in this order to the final image
+    degradations = [
+        (function, probability, strength)
+        for function, (probability, strength) in [
+            (degrade.rescale_and_rotate, args.degrade_rotate),
+            (degrade.warp, args.degrade_warp),
+            (degrade.sloppy_blur, args.degrade_blur),
+            (degrade.blotches, args.degrade_blobs),
+        ]
+        if probability > 0
+    ]
+    degrade.configure(args.degrade_float32, args.degrade_noise_scale)
+
+    write_pool = None
+    if args.write_threads > 0:
+        write_pool = WritePool(args.write_threads, args.write_queue)
+        # Before the writers close
+        util.Finalize(write_pool, write_pool.close, exitpriority=20)
+
+    profile = None
+    if profiles is not None:
+        profile = profiling.StageProfile()
+        # Before the queue's own finalizer (-5), which flushes it
+        util.Finalize(None, profiles.put, args=(profile,), exitpriority=5)
+
+    FakeTextDataGenerator.configure(
+        seed=args.seed,
+        profile=profile,
+        write_pool=write_pool,
+        out_dir=args.output_dir,
+        size=args.format,
+        extension=args.extension,
+        skewing_angle=args.skew_angle,
+        random_skew=args.random_skew,
+        blur=args.blur,
+        random_blur=args.random_blur,
+        background_type=args.background,
+        distorsion_type=args.distorsion,
+        distorsion_orientation=args.distorsion_orientation,
+        is_handwritten=args.handwritten,
+        name_format=args.name_format,
+        width=args.width,
+        alignment=args.alignment,
+        text_color=args.text_color,
+        orientation=args.orientation,
+        space_width=args.space_width,
+        margins=args.margins,
+        fit=args.fit,
+        writer=writer,
+        degradations=degradations,
+        grayscale=args.grayscale
+    )
+
+def report_profile(profiles, args):
+    """
+        Collect the StageProfiles of the exiting workers, print them and write them to --profile_file
+    """
+
+    worker_profiles = []
+    for _ in range(args.thread_count):
+        try:
+            worker_profiles.append(profiles.get(timeout=10))
+        except queue.Empty:
+            print('Warning: {} of {} workers did not send their profile'.format(args.thread_count - len(worker_profiles), args.thread_count))
+            break
+
+    summary = profiling.summary(worker_profiles)
+    profiling.print_summary(summary)
+    if args.profile_file:
+        with open(args.profile_file, 'w', encoding='utf8') as f:
+            json.dump(summary, f, indent=4)
+
+def positive_int(value):
+    """
+        Parse an integer of at least 1
+    """
+
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError('{} is not an integer'.format(value))
+    if number < 1:
+        raise argparse.ArgumentTypeError('{} has to be at least 1'.format(number))
+    return number
+
+def non_negative_int(value):
+    """
+        Parse an integer of at least 0
+    """
+
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError('{} is not an integer'.format(value))
+    if number < 0:
+        raise argparse.ArgumentTypeError('{} has to be at least 0'.format(number))
+    return number
+
+def degradation(value):
+    """
+        Parse a degradation as probability[,strength], the probability in [0, 1] and the strength above 0
+    """
+
+    try:
+        values = [float(v) for v in value.split(',')]
+    except ValueError:
+        raise argparse.ArgumentTypeError('{} is not a probability[,strength]'.format(value))
+    if len(values) > 2:
+        raise argparse.ArgumentTypeError('{} is not a probability[,strength]'.format(value))
+    probability, strength = values[0], values[1] if len(values) == 2 else 1.0
+    if not 0.0 <= probability <= 1.0:
+        raise argparse.ArgumentTypeError('The probability {} is not between 0 and 1'.format(probability))
+    if not strength > 0.0:
+        raise argparse.ArgumentTypeError('The strength {} has to be above 0'.format(strength))
+    return probability, strength
 
 def margins(margin):
     margins = margin.split(',')
@@ -30,7 +203,7 @@ def margins(margin):
         return [margins[0]] * 4
     return [int(m) for m in margins]
 
-def parse_arguments():
+def parse_arguments(argv=None):
     """
         Parse the command line arguments of the program.
     """
@@ -121,11 +294,51 @@ def parse_arguments():
     parser.add_argument(
         "-t",
         "--thread_count",
-        type=int,
+        type=positive_int,
         nargs="?",
         help="Define the number of thread to use for image generation",
         default=1,
     )
+    parser.add_argument(
+        "-sd",
+        "--seed",
+        type=int,
+        nargs="?",
+        help="Seed of the run. Every line gets its own random generator derived from the seed and its index, so the output does not depend on the number of threads and parts of a run can be generated again separately (except for -wk)",
+        default=None,
+    )
+    parser.add_argument(
+        "-st",
+        "--start_index",
+        type=int,
+        nargs="?",
+        help="Index of the first line. Defaults to 1, line 0 of the input file is skipped because of its BOM",
+        default=1,
+    )
+    parser.add_argument(
+        "-nsh",
+        "--num_shards",
+        type=int,
+        nargs="?",
+        help="Split the -c lines into this many parts (shards) of consecutive indices, e.g. to generate them on several machines",
+        default=1,
+    )
+    parser.add_argument(
+        "-shi",
+        "--shard_index",
+        type=int,
+        nargs="?",
+        help="Which of the -nsh shards this run generates, starting at 0. Each run writes a manifest, combine them with merge_manifests.py",
+        default=0,
+    )
+    parser.add_argument(
+        "-ch",
+        "--chunksize",
+        type=positive_int,
+        nargs="?",
+        help="Define the number of lines that are sent to a thread at once",
+        default=16,
+    )
     parser.add_argument(
         "-e",
         "--extension",
@@ -134,6 +347,31 @@ def parse_arguments():
         help="Define the extension to save the image with",
         default="png",
     )
+    parser.add_argument(
+        "-of",
+        "--output_format",
+        type=str,
+        nargs="?",
+        help="Define how the lines are written. files: one image and one .gt.txt file per line, tar: tar shards with image/.gt.txt pairs and an .idx index per shard, one shard per thread at a time, array: packed grayscale pixels and labels, one part per thread, with one index.npy for the whole run, see array_writer.py",
+        choices=["files", "tar", "array"],
+        default="files",
+    )
+    parser.add_argument(
+        "-ss",
+        "--shard_size",
+        type=int,
+        nargs="?",
+        help="Define the maximum size of a tar shard in MB. Only used with -of tar",
+        default=256,
+    )
+    parser.add_argument(
+        "-mw",
+        "--max_width",
+        type=int,
+        nargs="?",
+        help="Define the maximum line width of the array dataset, wider lines are skipped and marked as skipped in the manifest. 0 (default) keeps all lines. Only used with -of array",
+        default=0,
+    )
     parser.add_argument(
         "-k",
         "--skew_angle",
@@ -171,6 +409,48 @@ def parse_arguments():
         help="When set, the blur radius will be randomized between 0 and -bl.",
         default=False,
     )
+    parser.add_argument(
+        "-dr",
+        "--degrade_rotate",
+        type=degradation,
+        help="Rescale and rotate the resulting sample (brought back to its height) with the given probability, given as probability[,strength]. See augment_images.py",
+        default=(0.0, 1.0),
+    )
+    parser.add_argument(
+        "-dw",
+        "--degrade_warp",
+        type=degradation,
+        help="Warp the resulting sample with bounded gaussian noise, given as probability[,strength]",
+        default=(0.0, 1.0),
+    )
+    parser.add_argument(
+        "-db",
+        "--degrade_blur",
+        type=degradation,
+        help="Apply a gaussian blur and threshold (sloppy blur) to the resulting sample, given as probability[,strength]",
+        default=(0.0, 1.0),
+    )
+    parser.add_argument(
+        "-dbl",
+        "--degrade_blobs",
+        type=degradation,
+        help="Add random blotches to the resulting sample, given as probability[,strength]",
+        default=(0.0, 1.0),
+    )
+    parser.add_argument(
+        "-dfp",
+        "--degrade_float32",
+        action="store_true",
+        help="Compute the degradations in float32 instead of float64",
+        default=False,
+    )
+    parser.add_argument(
+        "-dns",
+        "--degrade_noise_scale",
+        type=positive_int,
+        help="Compute the noise field of the warping at 1/n of the resolution and interpolate it up, a factor of 2-4 is much faster and looks the same",
+        default=1,
+    )
     parser.add_argument(
         "-b",
         "--background",
@@ -185,13 +465,26 @@ def parse_arguments():
         action="store_true",
         help="Define if the data will be \"handwritten\" by an RNN",
     )
+    parser.add_argument(
+        "-hws",
+        "--handwritten_stroke_width",
+        type=positive_int,
+        help="Width of the handwritten strokes in pixels, at a line height of 128 pixels",
+        default=4,
+    )
+    parser.add_argument(
+        "-hwa",
+        "--handwritten_supersampling",
+        type=positive_int,
+        help="Anti-aliasing of the handwritten strokes, they are drawn this many times larger and scaled down. 1 disables it",
+        default=4,
+    )
     parser.add_argument(
         "-na",
         "--name_format",
         type=int,
-        help="Define how the produced files will be named. 0: [TEXT]_[ID].[EXT], 1: [ID]_[TEXT].[EXT] 2: [ID].[EXT] + one file labels.txt containing id-to-label mappings",
+        help="Define how the produced files will be named. 0: [TEXT]_[ID].[EXT], 1: [ID]_[TEXT].[EXT] 2: [ID].[EXT] 3: [UNIQUE HEX].[EXT] (see -ro). Each image gets a [NAME].gt.txt file with its label",
         default=2,
-        #file labels.txt will then be parse by file_parser.py to get all the .gt.txt. files 
     )
     parser.add_argument(
         "-d",
@@ -265,6 +558,37 @@ def parse_arguments():
         help="Apply a tight crop around the rendered text",
         default=False
     )
+    parser.add_argument(
+        "-fc",
+        "--font_cache",
+        type=int,
+        nargs="?",
+        help="Number of fonts kept loaded per thread. 0 (default) keeps all fonts of the language",
+        default=0
+    )
+    parser.add_argument(
+        "-wc",
+        "--word_cache",
+        type=int,
+        nargs="?",
+        help="Memory budget in MB per thread for caching rendered words. 0 disables the cache, which is needed if the text color must vary per pixel",
+        default=64
+    )
+    parser.add_argument(
+        "-pp",
+        "--picture_pool",
+        type=int,
+        nargs="?",
+        help="Memory budget in MB per thread for decoded background pictures, only used with -b 3",
+        default=256
+    )
+    parser.add_argument(
+        "-pws",
+        "--picture_width_step",
+        type=positive_int,
+        help="Pictures narrower than a line are scaled to its width rounded up to this step, so that lines of similar width share one scaled picture (e.g. 256). This changes the scale of the background crops of shorter lines. Defaults to 1, the exact line width",
+        default=1
+    )
     parser.add_argument(
         "-sf",
         "--show_font",
@@ -276,9 +600,60 @@ def parse_arguments():
         "-ro",
         "--rename_output",
         action="store_true",
-        help="Rename the output, to give a unique filename to the resulting images",
+        help="Give the resulting images unique hex filenames (name format 3) instead of incremental ones, useful to merge the output of several runs",
         default=False
     )
+    parser.add_argument(
+        "-re",
+        "--resume",
+        action="store_true",
+        help="Continue an interrupted run in the same output directory with the same arguments, only the lines missing in its manifest.jsonl are generated. With -sd the result is the same as that of an uninterrupted run",
+        default=False
+    )
+    parser.add_argument(
+        "-bc",
+        "--background_cache",
+        type=int,
+        nargs="?",
+        help="Memory budget in MB per thread for cached plain and noise backgrounds (-b 0 and 1), 0 generates every background anew",
+        default=64
+    )
+    parser.add_argument(
+        "-gs",
+        "--grayscale",
+        action="store_true",
+        help="Render, distort and save the lines with a single gray channel instead of RGB, the text color is converted to gray",
+        default=False
+    )
+    parser.add_argument(
+        "-wt",
+        "--write_threads",
+        type=non_negative_int,
+        help="Number of threads per worker that encode and write the lines while the next ones are rendered, 0 writes them in between",
+        default=0
+    )
+    parser.add_argument(
+        "-wq",
+        "--write_queue",
+        type=positive_int,
+        help="Maximum number of lines per worker waiting to be written with --write_threads, rendering pauses when it is full",
+        default=8
+    )
+    parser.add_argument(
+        "-pr",
+        "--profile",
+        action="store_true",
+        help="Time the stages of every line, print their percentiles and the throughput of every worker at the end",
+        default=False
+    )
+    parser.add_argument(
+        "-prf",
+        "--profile_file",
+        type=str,
+        nargs="?",
+        help="Write the stage histograms and worker throughput of --profile as JSON to this file (implies --profile)",
+        default="",
+    )
     parser.add_argument(
         "-rm",
         "--remove_old",
@@ -305,7 +680,7 @@ def parse_arguments():
 #     )
 # =============================================================================
 
-    return parser.parse_args()
+    return parser.parse_args(argv)
 
 def load_dict(lang):
     """
@@ -376,7 +751,14 @@ def main():
 
     # Argument parsing
     args = parse_arguments()
-    args.count += 1     
+    begin, end = index_range(args)
+
+    # A worker that fails to import it would be restarted forever, check it before starting them
+    if args.handwritten:
+        try:
+            import handwritten_text_generator
+        except ImportError as e:
+            raise SystemExit('Handwritten text (-hw) needs tensorflow, which could not be imported: {}'.format(e))
     
     # Create font (path) list
     fonts = load_fonts(args.language)
@@ -404,104 +786,86 @@ def main():
     curr_dir = os.getcwd()
     os.chdir(args.output_dir)   
 
+    if args.remove_old and args.resume:
+        raise ValueError("Cannot remove the old files of a run that is resumed")
+
     if args.remove_old: 
-        answer = input("\n\n-------------------------\n\nWarning. This will delete all png-,zip- and gt.txt files that currently reside in {}. Proceed? (y/n) ".format(os.getcwd()))
+        answer = input("\n\n-------------------------\n\nWarning. This will delete all png-,zip-,tar-,idx-,npy-,bin-,manifest- and gt.txt files that currently reside in {}. Proceed? (y/n) ".format(os.getcwd()))
         if answer == 'y': 
             for file in os.listdir(os.getcwd()):
-                if file.endswith('.png') or file.endswith('.gt.txt') or file.endswith('.zip'): 
+                if file.endswith(('.png', '.gt.txt', '.zip', '.tar', '.idx', '.npy', '.bin')) or file in (manifest.MANIFEST_NAME, manifest.RECORDS_NAME): 
                     os.remove(file)
         else: return 
 
     os.chdir(curr_dir)
-    # Creating synthetic sentences (or word)
-    strings = []
 
+    # Lines that a previous run already generated
+    completed = manifest.completed_indices(args.output_dir) if args.resume else set()
+
+    # Creating synthetic sentences (or word) for the lines [begin, end), they are produced lazily while the images are generated
     if args.use_wikipedia:
-        strings = create_strings_from_wikipedia(args.length, args.count, args.language)
+        strings = iter_strings_from_wikipedia(args.length, end - begin, args.language)
     elif args.input_file != '':
-        strings = create_strings_from_file(args.input_file, args.count)
+        strings = itertools.islice(iter_strings_from_file(args.input_file, end), begin, None)
     elif args.random_sequences:
-        strings = create_strings_randomly(args.length, args.random, args.count,
-                                          args.include_letters, args.include_numbers, args.include_symbols, args.language)
+        strings = iter_strings_randomly(args.length, args.random, end - begin,
+                                        args.include_letters, args.include_numbers, args.include_symbols, args.language, args.seed, begin)
         # Set a name format compatible with special characters automatically if they are used
         if args.include_symbols or True not in (args.include_letters, args.include_numbers, args.include_symbols):
             args.name_format = 2
     else:
-        strings = create_strings_from_dict(args.length, args.random, args.count, lang_dict)
-
-
-    string_count = len(strings)
-
-    p = Pool(args.thread_count)
-    for _ in tqdm(p.imap_unordered(
-        FakeTextDataGenerator.generate_from_tuple,
-        zip(
-            [i for i in range(0, string_count)],
-            strings,
-            [fonts[random.randrange(0, len(fonts))] for _ in range(0, string_count)],
-            [args.output_dir] * string_count,
-            [args.format] * string_count,
-            [args.extension] * string_count,
-            [args.skew_angle] * string_count,
-            [args.random_skew] * string_count,
-            [args.blur] * string_count,
-            [args.random_blur] * string_count,
-            [args.background] * string_count,
-            [args.distorsion] * string_count,
-            [args.distorsion_orientation] * string_count,
-            [args.handwritten] * string_count,
-            [args.name_format] * string_count,
-            [args.width] * string_count,
-            [args.alignment] * string_count,
-            [args.text_color] * string_count,
-            [args.orientation] * string_count,
-            [args.space_width] * string_count,
-            [args.margins] * string_count,
-            [args.fit] * string_count
-        )
-    ), total=args.count):
-        pass
-    p.terminate()
-
-
-
-    if args.name_format == 2:
-        # Create file with filename-to-label connections
-        with open(os.path.join(args.output_dir, "labels.txt"), 'w', encoding="utf8") as f:
-            for i in range(string_count):
-                file_name = str(i) + "." + args.extension
-                f.write("{} {}\n".format(file_name, strings[i]))
-                
-    #create txt-files for nn groundtruth
-    file_parser.parse_labels(args.extension)
-    
-    #delete 0th file bc it has strange start character that is not displayed in notepad but causes weird glyph in image
+        strings = iter_strings_from_dict(args.length, args.random, end - begin, lang_dict, args.seed, begin)
+
+    # Unique names are given when writing, so that nothing has to be renamed afterwards
+    if args.rename_output:
+        args.name_format = 3
+
+    # Only (index, text, font) is sent per line, the rest is set once per worker.
+    font_rngs = seeding.index_rngs(args.seed, seeding.FONT_STREAM, begin)
+    tasks = (
+        (i, s, fonts[font_rng.integers(len(fonts))])
+        for i, s, font_rng in zip(itertools.count(begin), strings, font_rngs)
+        if i not in completed
+    )
+    # The lines are sent in chunks, a worker returns the records of a chunk once all its lines are written
+    chunks = iter(lambda: list(itertools.islice(tasks, args.chunksize)), [])
+
+    # The workers write each image together with its .gt.txt file and return its manifest
+    # record, the records are logged as the lines are done
+    records = manifest.RecordLog(args.output_dir, append=args.resume)
+    profiles = Queue() if args.profile or args.profile_file else None
+    p = Pool(args.thread_count, initializer=init_worker, initargs=(fonts, args, profiles))
+    progress = tqdm(total=end - begin - len(completed.intersection(range(begin, end))))
+    for chunk_records in p.imap_unordered(FakeTextDataGenerator.generate_from_tasks, chunks):
+        for record in chunk_records:
+            records.write(record)
+        progress.update(len(chunk_records))
+    progress.close()
+    # Let the workers exit normally, so that they close their shards
+    p.close()
+    # The exiting workers block until their profiles are read from the queue
+    if profiles is not None:
+        report_profile(profiles, args)
+    p.join()
+    records.close()
+
+    if args.output_format == 'array':
+        array_writer.write_index(args.output_dir, begin, end)
+
+    summary = manifest.write_manifest(args.output_dir, {
+        'start_index': begin,
+        'end_index': end,
+        'shard_index': args.shard_index,
+        'num_shards': args.num_shards,
+        'seed': args.seed,
+        'output_format': args.output_format,
+        'arguments': vars(args),
+    })
+    if summary['skipped']:
+        print('{} lines were skipped, see the records with "skipped" in {}'.format(summary['skipped'], manifest.RECORDS_NAME))
+
     os.chdir(args.output_dir)
-    os.remove('0.png')
-    os.remove('0.gt.txt')
-    os.remove('labels.txt')
-    
     
-      
-    # ------------------ rename all imgs ------------------
-    
-    if args.rename_output: 
-        for file in os.listdir(os.getcwd()):
-            
-            if file.endswith('.png'): 
-                file_name = file.split('.')[0]
-                if(len(file_name)) > 10: continue       #important, bc otherwise it will double-find the newly created unique_name.pngs
-                txt_file = file_name + '.gt.txt'
-                
-                unique = str(uuid.uuid4().hex)
-                unique_name_png = unique + '.png'
-                unique_name_txt = unique + '.gt.txt'
-                
-                os.rename(file, unique_name_png)
-                os.rename(txt_file, unique_name_txt)
-                
-        
-   
     # ------------------ zip images ------------------
     
     if args.zip_output: 
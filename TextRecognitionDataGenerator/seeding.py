@@ -0,0 +1,40 @@
+"""
+Random number generators for reproducible runs. Every sample gets its own numpy generator,
+derived from the seed of the run and the index of the sample, so a sample comes out the same
+no matter which process or machine generates it and which other samples are generated.
+"""
+
+import itertools
+
+import numpy as np
+
+# Independent streams of one sample index
+SAMPLE_STREAM = 0
+STRING_STREAM = 1
+FONT_STREAM = 2
+
+def sample_rng(seed, index, stream=SAMPLE_STREAM):
+    """
+        Generator for one stream of sample index, a fresh unseeded one if seed is None
+    """
+
+    if seed is None:
+        return np.random.default_rng()
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(index, stream)))
+
+def index_rngs(seed, stream, start=0):
+    """
+        Generators of one stream for the indices start, start + 1, ...
+        Without a seed one fresh generator is used for all of them.
+    """
+
+    if seed is None:
+        return itertools.repeat(np.random.default_rng())
+    return (sample_rng(seed, index, stream) for index in itertools.count(start))
+
+def get_rng(rng):
+    """
+        The given generator, or a fresh unseeded one for functions called without
+    """
+
+    return rng if rng is not None else np.random.default_rng()
@@ -0,0 +1,102 @@
+"""
+Writes the generated lines into tar shards instead of one image and one .gt.txt file per line.
+Every shard <name>.tar contains the pairs <key>.<ext> and <key>.gt.txt (WebDataset layout) and
+comes with an index <name>.idx with one JSON line per sample, giving the offsets of both members.
+"""
+
+import io
+import json
+import os
+import tarfile
+import threading
+import time
+import uuid
+
+from PIL import Image
+
+from manifest import sample_record
+
+class ShardWriter(object):
+    """
+        Writes images and labels of one process into size capped tar shards.
+        A new shard is started when the current one would exceed max_bytes.
+    """
+
+    def __init__(self, out_dir, max_bytes, prefix='shard'):
+        self.out_dir = out_dir
+        self.max_bytes = max_bytes
+        # Unique per writer, so that workers and runs never write the same shard
+        self.prefix = '{}-{}'.format(prefix, uuid.uuid4().hex[:12])
+        self.shard_count = 0
+        self.sample_count = 0
+        self._tar = None
+        self._index = None
+        # The lines can be written from the threads of a WritePool, they are encoded concurrently
+        self._lock = threading.Lock()
+
+    def _open_shard(self):
+        self.close()
+        name = os.path.join(self.out_dir, '{}-{:05d}'.format(self.prefix, self.shard_count))
+        self._tar = tarfile.open(name + '.tar', 'w')
+        self._index = open(name + '.idx', 'w', encoding='utf8')
+        self.shard_count += 1
+
+    def _add_member(self, name, data):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = int(time.time())
+        self._tar.addfile(info, io.BytesIO(data))
+        # The data ends the member, padded to full blocks
+        return self._tar.offset - -(-len(data) // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+
+    def write(self, index, image_name, image, text):
+        """
+            Add line index, image is encoded in the format given by the extension of image_name.
+            Returns the manifest record of the line.
+        """
+
+        key, extension = os.path.splitext(image_name)
+
+        encoded = io.BytesIO()
+        image.save(encoded, format=Image.registered_extensions()[extension.lower()])
+        image_data = encoded.getvalue()
+        label_data = text.encode('utf8')
+
+        with self._lock:
+            return self._append(index, image_name, key, image_data, label_data)
+
+    def _append(self, index, image_name, key, image_data, label_data):
+        # Each member takes at least one header block and is padded to full blocks
+        sample_size = 4 * tarfile.BLOCKSIZE + len(image_data) + len(label_data)
+        if self._tar is None or (self.sample_count > 0 and self._tar.offset + sample_size > self.max_bytes):
+            self._open_shard()
+            self.sample_count = 0
+
+        image_offset = self._add_member(image_name, image_data)
+        label_offset = self._add_member(key + '.gt.txt', label_data)
+        self.sample_count += 1
+        # A line is only recorded as done once it is written, flushed so it survives a killed worker
+        self._tar.fileobj.flush()
+
+        self._index.write(json.dumps({
+            'index': index,
+            'key': key,
+            'image': image_name,
+            'image_offset': image_offset,
+            'image_size': len(image_data),
+            'label_offset': label_offset,
+            'label_size': len(label_data),
+        }, ensure_ascii=False) + '\n')
+        self._index.flush()
+
+        return sample_record(
+            index, image_name, image_data, label_data,
+            shard=os.path.basename(self._tar.name), image_offset=image_offset, label_offset=label_offset
+        )
+
+    def close(self):
+        if self._tar is not None:
+            self._tar.close()
+            self._index.close()
+            self._tar = None
+            self._index = None
@@ -1,51 +1,70 @@
-import random
 import re
 import string
 import requests
 
 from bs4 import BeautifulSoup
 
+from seeding import STRING_STREAM, index_rngs
+
 def create_strings_from_file(filename, count):
     """
         Create all strings by reading lines in specified files
     """
 
-    strings = []
+    return list(iter_strings_from_file(filename, count))
 
-    with open(filename, 'r', encoding="utf8") as f:
-        lines = [l.strip()[0:200] for l in f.readlines()]
-        if len(lines) == 0:
-            raise Exception("No lines could be read in file")
-        while len(strings) < count:
-            if len(lines) >= count - len(strings):
-                strings.extend(lines[0:count - len(strings)])
-            else:
-                strings.extend(lines)
+def iter_strings_from_file(filename, count):
+    """
+        Same as create_strings_from_file, but yields the strings one by one.
+        The file is read again from the start if it has less than count lines.
+    """
 
-    return strings
+    produced = 0
+    while produced < count:
+        with open(filename, 'r', encoding="utf8") as f:
+            for l in f:
+                if produced >= count:
+                    break
+                yield l.strip()[0:200]
+                produced += 1
+        if produced == 0:
+            raise Exception("No lines could be read in file")
 
-def create_strings_from_dict(length, allow_variable, count, lang_dict):
+def create_strings_from_dict(length, allow_variable, count, lang_dict, seed=None):
     """
         Create all strings by picking X random word in the dictionnary
     """
 
+    return list(iter_strings_from_dict(length, allow_variable, count, lang_dict, seed))
+
+def iter_strings_from_dict(length, allow_variable, count, lang_dict, seed=None, start=0):
+    """
+        Same as create_strings_from_dict, but yields the strings one by one.
+        With a seed, string i only depends on the seed and i, the first is string start.
+    """
+
     dict_len = len(lang_dict)
-    strings = []
-    for _ in range(0, count):
+    for _, rng in zip(range(0, count), index_rngs(seed, STRING_STREAM, start)):
         current_string = ""
-        for _ in range(0, random.randint(1, length) if allow_variable else length):
-            current_string += lang_dict[random.randrange(dict_len)][:-1]
+        for _ in range(0, int(rng.integers(1, length, endpoint=True)) if allow_variable else length):
+            current_string += lang_dict[rng.integers(dict_len)][:-1]
             current_string += ' '
-        strings.append(current_string[:-1])
-    return strings
+        yield current_string[:-1]
 
 def create_strings_from_wikipedia(minimum_length, count, lang):
     """
         Create all string by randomly picking Wikipedia articles and taking sentences from them.
     """
-    sentences = []
 
-    while len(sentences) < count:
+    return list(iter_strings_from_wikipedia(minimum_length, count, lang))
+
+def iter_strings_from_wikipedia(minimum_length, count, lang):
+    """
+        Same as create_strings_from_wikipedia, but yields the sentences page by page
+    """
+
+    produced = 0
+    while produced < count:
         # We fetch a random page
         page = requests.get('https://{}.wikipedia.org/wiki/Special:Random'.format(lang))
 
@@ -66,15 +85,23 @@ def create_strings_from_wikipedia(minimum_length, count, lang):
         ))
 
         # Remove the last lines that talks about contributing
-        sentences.extend(lines[0:max([1, len(lines) - 5])])
-
-    return sentences[0:count]
+        for sentence in lines[0:max([1, len(lines) - 5])][0:count - produced]:
+            yield sentence
+            produced += 1
 
-def create_strings_randomly(length, allow_variable, count, let, num, sym, lang):
+def create_strings_randomly(length, allow_variable, count, let, num, sym, lang, seed=None):
     """
         Create all strings by randomly sampling from a pool of characters.
     """
 
+    return list(iter_strings_randomly(length, allow_variable, count, let, num, sym, lang, seed))
+
+def iter_strings_randomly(length, allow_variable, count, let, num, sym, lang, seed=None, start=0):
+    """
+        Same as create_strings_randomly, but yields the strings one by one.
+        With a seed, string i only depends on the seed and i, the first is string start.
+    """
+
     # If none specified, use all three
     if True not in (let, num, sym):
         let, num, sym = True, True, True
@@ -97,12 +124,10 @@ def create_strings_randomly(length, allow_variable, count, let, num, sym, lang):
         min_seq_len = 2
         max_seq_len = 10
 
-    strings = []
-    for _ in range(0, count):
+    for _, rng in zip(range(0, count), index_rngs(seed, STRING_STREAM, start)):
         current_string = ""
-        for _ in range(0, random.randint(1, length) if allow_variable else length):
-            seq_len = random.randint(min_seq_len, max_seq_len)
-            current_string += ''.join([random.choice(pool) for _ in range(seq_len)])
+        for _ in range(0, int(rng.integers(1, length, endpoint=True)) if allow_variable else length):
+            seq_len = int(rng.integers(min_seq_len, max_seq_len, endpoint=True))
+            current_string += ''.join([pool[i] for i in rng.integers(len(pool), size=seq_len)])
             current_string += ' '
-        strings.append(current_string[:-1])
-    return strings
\ No newline at end of file
+        yield current_string[:-1]
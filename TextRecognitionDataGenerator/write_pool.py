@@ -0,0 +1,43 @@
+"""
+Encodes and writes the finished lines of a worker process in threads, so that rendering the
+next line overlaps with saving the previous ones. Encoding (zlib, libjpeg) and file writes
+release the GIL, which pays off most on slow or network storage.
+"""
+
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+class WritePool(object):
+    """
+        Runs write calls in threads. At most max_pending calls are queued or running,
+        submit blocks until one of them is done (backpressure on the rendering).
+    """
+
+    def __init__(self, threads, max_pending):
+        if threads < 1 or max_pending < 1:
+            raise ValueError('A write pool needs at least one thread and one pending line')
+        self._executor = ThreadPoolExecutor(threads, thread_name_prefix='write')
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._pending = []
+
+    def submit(self, func, *args):
+        self._slots.acquire()
+        future = self._executor.submit(func, *args)
+        future.add_done_callback(lambda _: self._slots.release())
+        self._pending.append(future)
+
+    def drain(self):
+        """
+            Wait until all submitted calls are done, returns their results in the order they
+            were submitted. Raises the first error after all calls finished.
+        """
+
+        pending, self._pending = self._pending, []
+        for future in pending:
+            future.exception()
+        return [future.result() for future in pending]
+
+    def close(self):
+        self.drain()
+        self._executor.shutdown()
@@ -11,6 +11,19 @@ import time, os
 import uuid 
 import pylab 
 import argparse 
+import sys 
+from multiprocessing import Pool 
+
+#the degradations are shared with the generator, which can apply them directly while generating 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'TextRecognitionDataGenerator'))
+import degrade 
+import seeding 
+from degrade import (
+    rescale_and_rotate, 
+    warp, 
+    sloppy_blur as sloppy_blur_image, 
+    blotches
+)
 
 
 
@@ -55,6 +68,37 @@ parser.add_argument(
         help="Argument to switch off rotation as it becomes performance-heavy when factor is high",
         default=False
     )
+parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        nargs="?",
+        help="Number of processes the images are augmented with",
+        default=1
+    )
+parser.add_argument(
+        "-fp",
+        "--float32",
+        action='store_true',
+        help="Compute the augmentations in float32 instead of float64",
+        default=False
+    )
+parser.add_argument(
+        "-ns",
+        "--noise_scale",
+        type=int,
+        nargs="?",
+        help="Compute the noise field of the warping at 1/n of the resolution and interpolate it up, a factor of 2-4 is much faster",
+        default=1
+    )
+parser.add_argument(
+        "-sd",
+        "--seed",
+        type=int,
+        nargs="?",
+        help="Seed for reproducible augmentations, every image gets its own random generator derived from the seed and its position in the sorted input",
+        default=None
+    )
 parser.add_argument(
         "-z",
         "--zip_output",
@@ -75,181 +119,107 @@ def get_image_paths(path):
         print("no images found")
         return
     
-    #write all img paths 
-    for file in os.listdir(path):
+    #write all img paths, the gt-file of an image has the same name with .gt.txt instead of .png 
+    for file in sorted(os.listdir(path)):
         
         if file.endswith(".png"):
+            gt_path = os.path.join(path, file[:-len(".png")] + ".gt.txt")
+            if not os.path.exists(gt_path): continue
             img_paths.append(os.path.join(path, file))
-        if file.endswith(".txt"):
-            if not file.startswith("labels"):
-                gt_paths.append(os.path.join(path,file))
+            gt_paths.append(gt_path)
         
     return img_paths, gt_paths
 
 
-def scale_and_rotate(img_paths, gt_paths, target_dir, fct): 
-    
-    if not os.path.exists(target_dir):
-        os.makedirs(target_dir)
-    os.chdir(target_dir)
-    
-    #read all imgs from path, set filename to current time, store and copy gt file 
+def read_image(img_path): 
+    image = plt.imread(img_path)
+    if np.size(np.shape(image)) > 2: image = image[:,:,0]    #slice to reduce to grayscale image
+    return image
+
+
+def save_augmentation(image, gt_path, target_dir, rng): 
+    #the name comes from the generator as well, so seeded runs also reproduce the names 
+    filename = uuid.UUID(bytes=rng.bytes(16), version=4).hex
+    img_name = os.path.join(target_dir, str(filename) + '.png')
+    txt_name = os.path.join(target_dir, str(filename) + '.gt.txt')
     
-    print("\nscaling and rotating {} images:".format(len(img_paths)))
-    for i in tqdm.tqdm(range(len(img_paths))):
-        filename = uuid.uuid4().hex
-        img_name = str(filename) + '.png'
-        txt_name = str(filename) + '.gt.txt'
-        
-        image = plt.imread(img_paths[i])
-        if np.size(np.shape(image)) > 2: image = image[:,:,0]    #slice to reduce to grayscale image
+    plt.imsave(img_name, image, cmap="gray")
+    shutil.copy(gt_path, txt_name)
 
-        image = transform.rescale(image, np.random.uniform(0.8,1.1)*fct)
-        image = transform.rotate(image, math.degrees(np.random.uniform(-0.02,0.02)*fct), mode='edge')  #rotate btwn -5 and 5 deg 
-        plt.imsave(img_name,image)
-        
-        shutil.copy(gt_paths[i],txt_name)
-        
-    print('rescaled, rotated and saved {} images and copied {} gt-files\n'.format(len(img_paths),len(gt_paths)))
+
+#name (also the folder name for separate output) and function of all augmentations 
+AUGMENTATIONS = [
+    ('scale_and_rotate', rescale_and_rotate),
+    ('warped', warp),
+    ('sloppy_blur', sloppy_blur_image),
+    ('random_blobs', blotches),
+]
+
+
+def augment_image(task): 
+    """
+        Decode one image once and apply all given augmentations to it, 
+        task is (index, img_path, gt_path, [(augmentation name, target_dir)], fct, seed) 
+    """
     
+    index, img_path, gt_path, targets, fct, seed = task
+    functions = dict(AUGMENTATIONS)
+    rng = seeding.sample_rng(seed, index)
     
+    image = read_image(img_path)
+    for name, target_dir in targets: 
+        save_augmentation(functions[name](image, fct, rng), gt_path, target_dir, rng)
 
-# nice, apply blur, distorsion and some warping -> like real handwritten ink 
-# the bigger sigma, the less blurry and distorted the resulting image will be
-def warp_images(img_paths, gt_paths, target_dir, fct): 
+
+def init_worker(float32=False, noise_scale=1): 
+    degrade.configure(float32, noise_scale)
+
+
+def augment_images(img_paths, gt_paths, targets, fct, workers=1, float32=False, noise_scale=1, seed=None): 
+    """
+        Apply the augmentations in targets ([(augmentation name, target_dir)]) to all images, 
+        every image is read only once. The images are distributed over workers processes.
+    """
     
-    if not os.path.exists(target_dir):
-        os.makedirs(target_dir)
-    os.chdir(target_dir)
+    for _, target_dir in targets: 
+        if not os.path.exists(target_dir):
+            os.makedirs(target_dir)
     
-    print("\ndistorting {} images:".format(len(img_paths)))
-    for i in tqdm.tqdm(range(len(img_paths))):
-        filename = uuid.uuid4().hex
-        img_name = str(filename) + '.png'
-        txt_name = str(filename) + '.gt.txt'
-        
-        image = plt.imread(img_paths[i])
-        if np.size(np.shape(image)) > 2: image = image[:,:,0]    #slice to reduce to grayscale image
-        sigma = np.random.uniform(4.0, 8.0)*(1/fct)
-        noise = bounded_gaussian_noise(image.shape, sigma, 5.0)
-        distorted_img = distort_with_noise(image, noise)
-
-        plt.imsave(img_name,distorted_img)
-        shutil.copy(gt_paths[i],txt_name)
-        
-    print('distorted {} images and copied {} gt-files\n'.format(len(img_paths),len(gt_paths)))    
+    print("\naugmenting {} images ({}) with {} worker(s):".format(len(img_paths), ', '.join(name for name, _ in targets), workers))
+    tasks = [(i, img_paths[i], gt_paths[i], targets, fct, seed) for i in range(len(img_paths))]
+    with Pool(workers, initializer=init_worker, initargs=(float32, noise_scale)) as p: 
+        for _ in tqdm.tqdm(p.imap_unordered(augment_image, tasks, chunksize=4), total=len(tasks)): 
+            pass
+    
+    print('created {} augmented images and copied {} gt-files\n'.format(len(img_paths)*len(targets),len(gt_paths)*len(targets)))
 
 
+def scale_and_rotate(img_paths, gt_paths, target_dir, fct): 
+    augment_images(img_paths, gt_paths, [('scale_and_rotate', target_dir)], fct)
+
+
+def warp_images(img_paths, gt_paths, target_dir, fct): 
+    augment_images(img_paths, gt_paths, [('warped', target_dir)], fct)
+
 
-#to blur images a bit, cut out small treshold parts and make the letters look less similar        
 def sloppy_blur(img_paths, gt_paths, target_dir, fct): 
-    
-    if not os.path.exists(target_dir):
-        os.makedirs(target_dir)
-    os.chdir(target_dir)
-    
-    print("\nsloppy-blurring {} images:".format(len(img_paths)))
-    for i in tqdm.tqdm(range(len(img_paths))): 
-        filename = uuid.uuid4().hex
-        img_name = str(filename) + '.png'
-        txt_name = str(filename) + '.gt.txt'
-        
-        image = plt.imread(img_paths[i])
-        if np.size(np.shape(image)) > 2: image = image[:,:,0]    #slice to reduce to grayscale image
-        #blurred_img = ocrodeg.binary_blur(image, np.random.uniform(0.5,3.0))
-        blurred_img = ndi.gaussian_filter(image,np.random.uniform(0.5,3.0)*fct)
-        tresholded_img = 1.0*(blurred_img>0.5)
-        plt.imsave(img_name,tresholded_img)
-        
-        shutil.copy(gt_paths[i],txt_name)
-        
-    print('created {} sloppy blurred images and copied {} gt-files\n'.format(len(img_paths),len(gt_paths)))    
+    augment_images(img_paths, gt_paths, [('sloppy_blur', target_dir)], fct)
 
 
 def add_random_blobs(img_paths, gt_paths, target_dir, fct): 
-    
-    if not os.path.exists(target_dir):
-        os.makedirs(target_dir)
-    os.chdir(target_dir)
-    
-    print("\nrandom-blobbing {} images:".format(len(img_paths)))
-    for i in tqdm.tqdm(range(len(img_paths))): 
-        filename = uuid.uuid4().hex
-        img_name = str(filename) + '.png'
-        txt_name = str(filename) + '.gt.txt' 
-    
-        image = plt.imread(img_paths[i])
-        if np.size(np.shape(image)) > 2: image = image[:,:,0]    #slice to reduce to grayscale image
-        blotched_img = random_blotches(image, (3e-4)*fct, (1e-4)*fct)
-        plt.imsave(img_name,blotched_img)
-        
-        shutil.copy(gt_paths[i],txt_name)
-        
-    print('created {} random-blobbed images and copied {} gt-files\n'.format(len(img_paths),len(gt_paths)))    
-    
+    augment_images(img_paths, gt_paths, [('random_blobs', target_dir)], fct)
     
     
 
-def augment_all(src_dir, target_dir): 
+def augment_all(src_dir, target_dir, fct=1.0, workers=1): 
     
     image_paths, gt_paths = get_image_paths(src_dir)    
     
-    scale_and_rotate(image_paths, gt_paths, target_dir)
-    warp_images(image_paths, gt_paths, target_dir)
-    sloppy_blur(image_paths,gt_paths, target_dir)
-    add_random_blobs(image_paths, gt_paths, target_dir)
-    
+    augment_images(image_paths, gt_paths, [(name, target_dir) for name, _ in AUGMENTATIONS], fct, workers)
     
     
     
-## copied from degrade.py to avoid version conflicts: 
     
-def bounded_gaussian_noise(shape, sigma, maxdelta):
-    n, m = shape
-    deltas = pylab.rand(2, n, m)
-    deltas = ndi.gaussian_filter(deltas, (0, sigma, sigma))
-    deltas -= np.amin(deltas)
-    deltas /= np.amax(deltas)
-    deltas = (2*deltas-1) * maxdelta
-    return deltas
-
-def distort_with_noise(image, deltas, order=1):
-    assert deltas.shape[0] == 2
-    assert image.shape == deltas.shape[1:], (image.shape, deltas.shape)
-    n, m = image.shape
-    xy = np.transpose(np.array(np.meshgrid(
-        range(n), range(m))), axes=[0, 2, 1])
-    deltas += xy
-    return ndi.map_coordinates(image, deltas, order=order, mode="reflect")
-
-def random_blobs(shape, blobdensity, size, roughness=2.0):
-    from random import randint
-    h, w = shape
-    numblobs = int(blobdensity * w * h)
-    mask = np.zeros((h, w), 'i')
-    for i in range(numblobs):
-        mask[randint(0, h-1), randint(0, w-1)] = 1
-    dt = ndi.distance_transform_edt(1-mask)
-    mask =  np.array(dt < size, 'f')
-    mask = ndi.gaussian_filter(mask, size/(2*roughness))
-    mask -= np.amin(mask)
-    mask /= np.amax(mask)
-    noise = pylab.rand(h, w)
-    noise = ndi.gaussian_filter(noise, size/(2*roughness))
-    noise -= np.amin(noise)
-    noise /= np.amax(noise)
-    return np.array(mask * noise > 0.5, 'f')
-
-def random_blotches(image, fgblobs, bgblobs, fgscale=10, bgscale=10):
-    fg = random_blobs(image.shape, fgblobs, fgscale)
-    bg = random_blobs(image.shape, bgblobs, bgscale)
-    return np.minimum(np.maximum(image, fg), 1-bg)
-    
-    
-    
-
-
-
 def main(): 
     results = parser.parse_args() 
     
@@ -273,46 +243,28 @@ def main():
     
     img_paths, gt_paths = get_image_paths(results.input_folder)
     
+    names = [name for name, _ in AUGMENTATIONS if not (results.rotation_toggle and name == 'scale_and_rotate')]
     
     if results.separate_output == True: 
-        
-        root_dir = results.output_folder 
-        
-        if not results.rotation_toggle: 
-            target_dir = os.path.join(root_dir,'scale_and_rotate')
-            scale_and_rotate(img_paths,gt_paths,target_dir,fct)
-        
-        target_dir = os.path.join(root_dir,'warped')
-        warp_images(img_paths,gt_paths,target_dir,fct)
-        
-        target_dir = os.path.join(root_dir,'sloppy_blur')
-        sloppy_blur(img_paths,gt_paths,target_dir,fct)
-        
-        target_dir = os.path.join(root_dir,'random_blobs')
-        add_random_blobs(img_paths,gt_paths,target_dir,fct)
-    
-    
+        targets = [(name, os.path.join(results.output_folder, name)) for name in names]
     else: 
-        target_dir = results.output_folder     
-        
-        if not results.rotation_toggle:
-            scale_and_rotate(img_paths, gt_paths, target_dir,fct)
-        warp_images(img_paths, gt_paths, target_dir,fct)
-        sloppy_blur(img_paths,gt_paths, target_dir,fct)
-        add_random_blobs(img_paths, gt_paths, target_dir,fct)
+        targets = [(name, results.output_folder) for name in names]
+    
+    #all augmentations in one pass, so every image is only decoded once 
+    augment_images(img_paths, gt_paths, targets, fct, results.workers, results.float32, results.noise_scale, results.seed)
     
     
     if results.zip_output == True: 
     
         import zipfile 
         
-        zip_name = str(uuid.uuid4().hex)+'.zip'
+        zip_name = os.path.join(results.output_folder, str(uuid.uuid4().hex)+'.zip')
         zip_handler = zipfile.ZipFile(zip_name, 'w', zipfile.ZIP_DEFLATED)
         
         for file in os.listdir(results.output_folder): 
             if not file.endswith('.zip'):
                 if file.endswith('.png') or file.endswith('.gt.txt'):
-                    zip_handler.write(file)
+                    zip_handler.write(os.path.join(results.output_folder, file), file)
             
         zip_handler.close()
         print("\nCreated Zip-Archive in {}.".format(results.output_folder))
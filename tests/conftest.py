@@ -0,0 +1,45 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+# The generator modules import each other by name and find their data (fonts, dicts,
+# pictures) relative to the working directory, like when run.py is started from there
+PACKAGE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'TextRecognitionDataGenerator')
+sys.path.insert(0, PACKAGE_DIR)
+
+@pytest.fixture
+def package_dir(monkeypatch):
+    """
+        Run the test from the generator directory
+    """
+
+    monkeypatch.chdir(PACKAGE_DIR)
+    return PACKAGE_DIR
+
+# Seconds a run of run.py may take in the tests, a run that hangs fails them
+GENERATE_TIMEOUT = 300
+
+@pytest.fixture
+def generate(package_dir):
+    """
+        Run run.py with the given arguments from the generator directory
+    """
+
+    def run(*args):
+        subprocess.run(
+            [sys.executable, 'run.py'] + [str(arg) for arg in args],
+            cwd=package_dir, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=GENERATE_TIMEOUT
+        )
+
+    return run
+
+def read_records(out_dir):
+    """
+        The records of manifest.jsonl in out_dir by index
+    """
+
+    with open(os.path.join(str(out_dir), 'manifest.jsonl'), encoding='utf8') as f:
+        return {record['index']: record for record in map(json.loads, f)}
@@ -0,0 +1,86 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from PIL import Image
+
+import array_writer
+import manifest
+
+def _line(height, width, value):
+    return Image.fromarray(np.full((height, width), value, dtype=np.uint8), 'L')
+
+def _write(out_dir, writer, lines):
+    """
+        Write (index, image, text) lines and log their records like run.py does
+    """
+
+    log = manifest.RecordLog(str(out_dir))
+    for index, image, text in lines:
+        log.write(writer.write(index, '{}.png'.format(index), image, text))
+    log.close()
+
+def test_lines_are_packed_and_read_back(tmp_path):
+    writer = array_writer.ArrayWriter(str(tmp_path))
+    lines = [(10, _line(32, 100, 1), 'ab'), (11, _line(32, 7, 2), 'c d'), (13, _line(20, 50, 3), 'é')]
+    _write(tmp_path, writer, lines)
+    writer.close()
+
+    # Only the real pixels are stored
+    assert os.path.getsize(str(tmp_path / writer.lines_name)) == 32 * 100 + 32 * 7 + 20 * 50
+
+    index = array_writer.write_index(str(tmp_path), 10, 14)
+    assert list(index['width']) == [100, 7, 0, 50]
+    assert list(index['offset'][[0, 1, 3]]) == [0, 3200, 3424]
+
+    dataset = array_writer.open_dataset(str(tmp_path))
+    for index, image, text in lines:
+        pixels, label = array_writer.read_line(dataset, index - 10)
+        assert np.array_equal(pixels, np.asarray(image))
+        assert label == text
+    with pytest.raises(ValueError):
+        array_writer.read_line(dataset, 2)
+
+def test_wide_lines_are_skipped_and_recorded(tmp_path):
+    writer = array_writer.ArrayWriter(str(tmp_path), max_width=64)
+    _write(tmp_path, writer, [(0, _line(32, 64, 1), 'fits'), (1, _line(32, 65, 2), 'too wide')])
+    writer.close()
+
+    with open(str(tmp_path / manifest.RECORDS_NAME), encoding='utf8') as f:
+        records = [json.loads(line) for line in f]
+    assert 'skipped' not in records[0]
+    assert 'skipped' in records[1]
+
+    index = array_writer.write_index(str(tmp_path), 0, 2)
+    assert list(index['width']) == [64, 0]
+    summary = manifest.write_manifest(str(tmp_path), {'start_index': 0, 'end_index': 2})
+    assert (summary['count'], summary['skipped'], summary['missing']) == (2, 1, 0)
+
+def test_long_labels_are_kept(tmp_path):
+    writer = array_writer.ArrayWriter(str(tmp_path))
+    text = 'lorem ipsum ' * 500
+    _write(tmp_path, writer, [(0, _line(8, 8, 0), text)])
+    writer.close()
+
+    array_writer.write_index(str(tmp_path), 0, 1)
+    assert array_writer.read_line(array_writer.open_dataset(str(tmp_path)), 0)[1] == text
+
+def test_parts_of_several_writers(tmp_path):
+    first = array_writer.ArrayWriter(str(tmp_path))
+    second = array_writer.ArrayWriter(str(tmp_path))
+    log = manifest.RecordLog(str(tmp_path))
+    for index in range(6):
+        writer = first if index % 2 else second
+        log.write(writer.write(index, '{}.png'.format(index), _line(4, index + 1, index), str(index)))
+    log.close()
+    first.close()
+    second.close()
+
+    array_writer.write_index(str(tmp_path), 0, 6)
+    dataset = array_writer.open_dataset(str(tmp_path))
+    assert len(dataset[1]) == 2
+    for index in range(6):
+        pixels, label = array_writer.read_line(dataset, index)
+        assert pixels.shape == (4, index + 1) and (pixels == index).all() and label == str(index)
@@ -0,0 +1,88 @@
+import math
+
+import numpy as np
+import pytest
+
+from PIL import Image
+
+import background_generator
+
+def _quasicrystal_reference(height, width, rng):
+    """
+        The former per pixel implementation of background_generator.quasicrystal
+    """
+
+    image = Image.new("L", (width, height))
+    pixels = image.load()
+
+    frequency = rng.random() * 30 + 20 # frequency
+    phase = rng.random() * 2 * math.pi # phase
+    rotation_count = int(rng.integers(10, 20, endpoint=True)) # of rotations
+
+    for kw in range(width):
+        y = float(kw) / (width - 1) * 4 * math.pi - 2 * math.pi
+        for kh in range(height):
+            x = float(kh) / (height - 1) * 4 * math.pi - 2 * math.pi
+            z = 0.0
+            for i in range(rotation_count):
+                r = math.hypot(x, y)
+                a = math.atan2(y, x) + i * math.pi * 2.0 / rotation_count
+                z += math.cos(r * math.sin(a) * frequency + phase)
+            c = int(255 - round(255 * z / rotation_count))
+            pixels[kw, kh] = c # grayscale
+    return image.convert('RGBA')
+
+@pytest.mark.parametrize('seed, height, width', [(0, 2, 2), (1, 7, 13), (2, 32, 48), (3, 65, 150)])
+def test_quasicrystal_matches_reference(seed, height, width):
+    expected = np.array(_quasicrystal_reference(height, width, np.random.default_rng(seed)), dtype=np.int16)
+    actual = np.array(background_generator.quasicrystal(height, width, np.random.default_rng(seed)), dtype=np.int16)
+
+    # numpy's sin/cos may differ in the last bit, which can flip the rounding of single pixels
+    difference = np.abs(expected - actual)
+    assert difference.max() <= 1
+    assert np.count_nonzero(difference) <= 0.001 * difference.size
+
+def test_quasicrystal_grayscale():
+    rgba = background_generator.quasicrystal(20, 30, np.random.default_rng(0))
+    gray = background_generator.quasicrystal(20, 30, np.random.default_rng(0), grayscale=True)
+
+    assert gray.mode == 'L'
+    assert np.array_equal(np.array(rgba.convert('L')), np.array(gray))
+
+@pytest.fixture
+def pictures(tmp_path, monkeypatch):
+    """
+        A pictures folder with one picture narrower than the tested lines, the pool is reset
+    """
+
+    (tmp_path / 'pictures').mkdir()
+    pixels = np.random.default_rng(0).integers(0, 256, (40, 100, 3), dtype=np.uint8)
+    Image.fromarray(pixels, 'RGB').save(str(tmp_path / 'pictures' / 'paper.png'))
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(background_generator, '_picture_names', {})
+    yield Image.fromarray(pixels, 'RGB')
+    background_generator.configure_picture_pool(background_generator.PICTURE_POOL_MAX_BYTES)
+
+def test_picture_is_scaled_to_the_line_width(pictures):
+    background_generator.configure_picture_pool(background_generator.PICTURE_POOL_MAX_BYTES)
+    height, width = 32, 300
+
+    # Like the former implementation: scale to the line width, crop at a random height
+    rng = np.random.default_rng(5)
+    rng.integers(1)
+    scaled = pictures.resize([width, int(40 * (width / 100))], Image.ANTIALIAS)
+    y = int(rng.integers(0, scaled.size[1] - height, endpoint=True))
+    expected = scaled.crop((0, y, width, y + height))
+
+    actual = background_generator.picture(height, width, np.random.default_rng(5))
+
+    assert np.array_equal(np.array(expected), np.array(actual))
+
+def test_picture_width_step_shares_scaled_pictures(pictures):
+    background_generator.configure_picture_pool(background_generator.PICTURE_POOL_MAX_BYTES, 256)
+
+    for width in [300, 400, 500]:
+        assert background_generator.picture(32, width, np.random.default_rng(0)).size == (width, 32)
+
+    # The decoded picture and one picture scaled to 512 for all three widths
+    assert background_generator.picture_pool_info()['entries'] == 2
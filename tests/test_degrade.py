@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+import scipy.ndimage as ndi
+
+from PIL import Image
+
+import degrade
+
+def _warp_reference(image, sigma, rng):
+    """
+        The former warp of augment_images.py, a new coordinate grid per image and float64 only
+    """
+
+    n, m = image.shape
+    deltas = rng.random((2, n, m))
+    deltas = ndi.gaussian_filter(deltas, (0, sigma, sigma))
+    deltas -= np.amin(deltas)
+    deltas /= np.amax(deltas)
+    deltas = (2*deltas-1) * 5.0
+    xy = np.transpose(np.array(np.meshgrid(range(n), range(m))), axes=[0, 2, 1])
+    deltas += xy
+    return ndi.map_coordinates(image, deltas, order=1, mode="reflect")
+
+def _line(height=32, width=120):
+    """
+        Dark strokes on white, like a text line
+    """
+
+    image = np.ones((height, width))
+    image[8:24, 10:110:7] = 0
+    image[14:18, 10:110] = 0
+    return image
+
+# The float64 path has to match the reference exactly, float32 up to rounding
+@pytest.mark.parametrize('dtype, tolerance', [(np.float64, 0), (np.float32, 1e-3)])
+def test_warp_matches_reference(dtype, tolerance):
+    image = _line()
+    expected = _warp_reference(image, 6.0, np.random.default_rng(0))
+
+    noise = degrade.bounded_gaussian_noise(image.shape, 6.0, 5.0, dtype, rng=np.random.default_rng(0))
+    actual = degrade.distort_with_noise(image.astype(dtype), noise)
+
+    assert np.abs(expected - actual).max() <= tolerance
+
+@pytest.mark.parametrize('scale', [2, 4])
+def test_scaled_noise_stays_bounded(scale):
+    noise = degrade.bounded_gaussian_noise((33, 101), 6.0, 5.0, np.float32, scale, np.random.default_rng(0))
+
+    assert noise.shape == (2, 33, 101)
+    assert np.abs(noise).max() <= 5.0 + 1e-5
+
+@pytest.mark.parametrize('mode', ['L', 'RGB', 'RGBA'])
+def test_degraded_images_keep_their_mode(mode):
+    image = Image.new(mode, (120, 32), 'white')
+    degraded = degrade.apply_degradations(image, [(degrade.warp, 1.0, 1.0)], np.random.default_rng(0))
+    assert degraded.mode == mode
+    assert degraded.size == image.size
+
+def test_skipped_degradations_return_the_image():
+    image = Image.new('RGB', (120, 32), 'white')
+    assert degrade.apply_degradations(image, [(degrade.warp, 0.0, 1.0)], np.random.default_rng(0)) is image
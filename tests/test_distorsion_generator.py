@@ -0,0 +1,97 @@
+import math
+
+import numpy as np
+import pytest
+
+from PIL import Image
+
+import distorsion_generator
+
+def _apply_func_distorsion_reference(image, vertical, horizontal, max_offset, func):
+    """
+        The former per row and column implementation of _apply_func_distorsion
+    """
+
+    if not vertical and not horizontal:
+        return image
+
+    img_arr = np.array(image.convert('RGBA'))
+
+    vertical_offsets = [func(i) for i in range(img_arr.shape[1])]
+    horizontal_offsets = [
+        func(i)
+        for i in range(
+            img_arr.shape[0] + (
+                (max(vertical_offsets) - min(min(vertical_offsets), 0)) if vertical else 0
+            )
+        )
+    ]
+
+    new_img_arr = np.zeros((
+                        img_arr.shape[0] + (2 * max_offset if vertical else 0),
+                        img_arr.shape[1] + (2 * max_offset if horizontal else 0),
+                        4
+                    ))
+
+    new_img_arr_copy = np.copy(new_img_arr)
+
+    if vertical:
+        column_height = img_arr.shape[0]
+        for i, o in enumerate(vertical_offsets):
+            column_pos = (i + max_offset) if horizontal else i
+            new_img_arr[max_offset+o:column_height+max_offset+o, column_pos, :] = img_arr[:, i, :]
+
+    if horizontal:
+        row_width = img_arr.shape[1]
+        for i, o in enumerate(horizontal_offsets):
+            if vertical:
+                new_img_arr_copy[i, max_offset+o:row_width+max_offset+o,:] = new_img_arr[i, max_offset:row_width+max_offset, :]
+            else:
+                new_img_arr[i, max_offset+o:row_width+max_offset+o,:] = img_arr[i, :, :]
+
+    return Image.fromarray(np.uint8(new_img_arr_copy if horizontal and vertical else new_img_arr)).convert('RGBA')
+
+def _text_image(height=30, width=90):
+    """
+        An RGBA image with opaque dark strokes on a transparent background
+    """
+
+    pixels = np.zeros((height, width, 4), dtype=np.uint8)
+    pixels[5:25, 3:87:5] = (40, 40, 40, 255)
+    pixels[12:16, 3:87] = (80, 20, 10, 200)
+    return Image.fromarray(pixels, 'RGBA')
+
+@pytest.mark.parametrize('name, function', [
+    ('sin', lambda x, max_offset: int(math.sin(math.radians(x)) * max_offset)),
+    ('cos', lambda x, max_offset: int(math.cos(math.radians(x)) * max_offset)),
+])
+@pytest.mark.parametrize('vertical, horizontal', [(True, False), (False, True), (True, True)])
+def test_distorsion_matches_reference(name, function, vertical, horizontal):
+    image = _text_image()
+    max_offset = int(image.height ** 0.5)
+
+    expected = _apply_func_distorsion_reference(image, vertical, horizontal, max_offset, lambda x: function(x, max_offset))
+    actual = getattr(distorsion_generator, name)(image, vertical=vertical, horizontal=horizontal)
+
+    assert actual.mode == 'RGBA'
+    assert np.array_equal(np.array(expected), np.array(actual))
+
+@pytest.mark.parametrize('vertical, horizontal', [(True, False), (False, True), (True, True)])
+def test_random_distorsion_is_seeded(vertical, horizontal):
+    image = _text_image()
+
+    first = distorsion_generator.random(image, vertical, horizontal, np.random.default_rng(3))
+    second = distorsion_generator.random(image, vertical, horizontal, np.random.default_rng(3))
+
+    assert np.array_equal(np.array(first), np.array(second))
+    # The opaque text pixels are only moved
+    assert np.count_nonzero(np.array(first)[:, :, 3]) == np.count_nonzero(np.array(image)[:, :, 3])
+
+def test_grayscale_distorsion_matches_rgba():
+    image = _text_image()
+
+    rgba = distorsion_generator.sin(image.convert('LA').convert('RGBA'), vertical=True, horizontal=True)
+    gray = distorsion_generator.sin(image.convert('LA'), vertical=True, horizontal=True)
+
+    assert gray.mode == 'LA'
+    assert np.array_equal(np.array(rgba.convert('LA')), np.array(gray))
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('tensorflow')
+
+import handwritten_text_generator
+
+TRANSLATION = {c: i for i, c in enumerate(' abcdef')}
+
+class FakeStep(object):
+    """
+        A network step that finishes a text after as many steps as the index of its first
+        character, counting the steps in its state
+    """
+
+    def __init__(self):
+        self.batch_sizes = []
+
+    def __call__(self, coord, sequence, bias, steps):
+        batch = coord.shape[0]
+        self.batch_sizes.append(batch)
+        steps = steps + 1
+        mixture = np.full((batch, 2), 0.5)
+        finish = steps >= np.argmax(sequence[:, 0], axis=1)[:, np.newaxis]
+        return [np.zeros((batch, 1)), mixture, mixture, mixture, mixture, mixture, np.zeros((batch, 2)), finish, steps]
+
+def _model(step):
+    return handwritten_text_generator.Model(None, None, TRANSLATION, step, [1])
+
+def test_words_step_together_until_they_finish():
+    step = FakeStep()
+    coords = handwritten_text_generator._sample_words(_model(step), ['cab', 'ab', 'fab', 'ef', 'aaa'], np.random.default_rng(0))
+
+    # Start point and one point per step, the last ends the stroke
+    assert [len(c) for c in coords] == [4, 2, 7, 6, 2]
+    assert all(c[-1, 2] == 1. for c in coords)
+    # The three letter words shrink from 3 rows as they finish, then the two letter words
+    assert step.batch_sizes == [3, 2, 2, 1, 1, 1, 2, 1, 1, 1, 1]
+
+def test_batches_are_limited(monkeypatch):
+    monkeypatch.setattr(handwritten_text_generator, 'BATCH_SIZE', 2)
+    step = FakeStep()
+    handwritten_text_generator._sample_words(_model(step), ['ab', 'ab', 'ab'], np.random.default_rng(0))
+    assert step.batch_sizes == [2, 1]
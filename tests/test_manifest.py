@@ -0,0 +1,56 @@
+import hashlib
+import json
+import os
+
+import pytest
+
+import manifest
+
+def _run(out_dir, start_index, end_index, indices, seed=3):
+    """
+        Write the manifest of a run of [start_index, end_index) that generated indices
+    """
+
+    os.makedirs(str(out_dir))
+    log = manifest.RecordLog(str(out_dir))
+    for index in indices:
+        log.write(manifest.sample_record(index, '{}.png'.format(index), b'image', 'label {}'.format(index).encode('utf8')))
+    log.close()
+    return manifest.write_manifest(str(out_dir), {'start_index': start_index, 'end_index': end_index, 'seed': seed})
+
+def test_sample_record():
+    record = manifest.sample_record(4, '4.png', b'image', 'ä'.encode('utf8'), shard='shard.tar')
+    assert record['index'] == 4 and record['shard'] == 'shard.tar'
+    assert (record['image_size'], record['label_size']) == (5, 2)
+    assert record['label_sha256'] == hashlib.sha256('ä'.encode('utf8')).hexdigest()
+
+def test_write_and_read_manifest(tmp_path):
+    summary = _run(tmp_path / 'run', 0, 5, [0, 1, 3])
+    assert (summary['count'], summary['skipped'], summary['missing']) == (3, 0, 2)
+    assert manifest.read_manifest(str(tmp_path / 'run')) == summary
+
+    with open(str(tmp_path / 'run' / manifest.RECORDS_NAME), 'a', encoding='utf8') as f:
+        f.write(json.dumps({'index': 4}) + '\n')
+    with pytest.raises(ValueError):
+        manifest.read_manifest(str(tmp_path / 'run'))
+
+def test_merge_manifests(tmp_path):
+    _run(tmp_path / 'b', 3, 6, [3, 4, 5])
+    _run(tmp_path / 'a', 0, 3, [0, 2])
+    merged = manifest.merge_manifests([str(tmp_path / 'b'), str(tmp_path / 'a')], str(tmp_path / 'merged'))
+
+    assert (merged['start_index'], merged['end_index'], merged['count'], merged['missing']) == (0, 6, 5, 1)
+    assert merged['seed'] == 3
+    assert [run['directory'] for run in merged['runs']] == [os.path.join('..', 'a'), os.path.join('..', 'b')]
+
+    with open(str(tmp_path / 'merged' / manifest.RECORDS_NAME), encoding='utf8') as f:
+        records = [json.loads(line) for line in f]
+    assert [record['index'] for record in records] == [0, 2, 3, 4, 5]
+    assert records[0]['directory'] == os.path.join('..', 'a')
+    assert manifest.read_manifest(str(tmp_path / 'merged')) == merged
+
+def test_overlapping_runs_are_not_merged(tmp_path):
+    _run(tmp_path / 'a', 0, 4, [0, 1])
+    _run(tmp_path / 'b', 3, 6, [3])
+    with pytest.raises(ValueError):
+        manifest.merge_manifests([str(tmp_path / 'a'), str(tmp_path / 'b')], str(tmp_path / 'merged'))
@@ -0,0 +1,54 @@
+import hashlib
+import json
+import os
+
+import pytest
+
+import array_writer
+import manifest
+
+from conftest import read_records
+
+def test_cut_off_record_is_removed(tmp_path):
+    lines = [json.dumps({'index': index}) + '\n' for index in (4, 2)]
+    path = str(tmp_path / manifest.RECORDS_NAME)
+    with open(path, 'w', encoding='utf8') as f:
+        f.write(''.join(lines) + '{"index": 7, "ima')
+
+    assert manifest.completed_indices(str(tmp_path)) == {2, 4}
+    with open(path, encoding='utf8') as f:
+        assert f.read() == ''.join(lines)
+
+def test_nothing_to_resume(tmp_path):
+    assert manifest.completed_indices(str(tmp_path)) == set()
+
+@pytest.mark.parametrize('output_format', ['files', 'array'])
+def test_resumed_run_matches_an_uninterrupted_one(generate, tmp_path, output_format):
+    arguments = ['-c', 6, '-sd', 5, '-of', output_format]
+    generate(*arguments, '--output_dir', tmp_path / 'full')
+    generate(*arguments, '--output_dir', tmp_path / 'resumed')
+
+    # Interrupt the second run after three lines, in the middle of the fourth record
+    path = str(tmp_path / 'resumed' / manifest.RECORDS_NAME)
+    with open(path, encoding='utf8') as f:
+        lines = f.readlines()
+    with open(path, 'w', encoding='utf8') as f:
+        f.write(''.join(lines[:3]) + lines[3][:10])
+    os.remove(str(tmp_path / 'resumed' / manifest.MANIFEST_NAME))
+
+    generate(*arguments, '-re', '--output_dir', tmp_path / 'resumed')
+
+    full = read_records(tmp_path / 'full')
+    resumed = read_records(tmp_path / 'resumed')
+    with open(path, encoding='utf8') as f:
+        assert len(f.readlines()) == 6
+    for index, record in full.items():
+        assert (resumed[index]['image_sha256'], resumed[index]['label_sha256']) == (record['image_sha256'], record['label_sha256'])
+    assert manifest.read_manifest(str(tmp_path / 'resumed'))['count'] == 6
+
+    if output_format == 'array':
+        # The index covers the lines of both parts
+        dataset = array_writer.open_dataset(str(tmp_path / 'resumed'))
+        for i, index in enumerate(sorted(full)):
+            label = array_writer.read_line(dataset, i)[1]
+            assert hashlib.sha256(label.encode('utf8')).hexdigest() == full[index]['label_sha256']
@@ -0,0 +1,72 @@
+import argparse
+import importlib.util
+import subprocess
+
+import pytest
+
+import run
+
+@pytest.mark.parametrize('value, expected', [('0', (0.0, 1.0)), ('1', (1.0, 1.0)), ('0.3,2', (0.3, 2.0))])
+def test_degradation_arguments(value, expected):
+    assert run.degradation(value) == expected
+
+@pytest.mark.parametrize('value', ['-0.1', '1.5', '0.5,0', '0.5,-1', '0.5,1,2', 'often'])
+def test_invalid_degradation_arguments(value):
+    with pytest.raises(argparse.ArgumentTypeError):
+        run.degradation(value)
+
+@pytest.mark.parametrize('value, expected', [('1', 1), ('16', 16)])
+def test_positive_int_arguments(value, expected):
+    assert run.positive_int(value) == expected
+
+@pytest.mark.parametrize('value', ['0', '-2', '1.5', 'many'])
+def test_invalid_positive_int_arguments(value):
+    with pytest.raises(argparse.ArgumentTypeError):
+        run.positive_int(value)
+
+@pytest.mark.parametrize('argv', [['-t', '0'], ['-ch', '0']])
+def test_invalid_arguments_stop_the_parser(argv):
+    with pytest.raises(SystemExit):
+        run.parse_arguments(argv)
+
+@pytest.mark.skipif(importlib.util.find_spec('tensorflow') is not None, reason='tensorflow is installed')
+def test_handwriting_without_tensorflow_fails(generate, tmp_path):
+    with pytest.raises(subprocess.CalledProcessError):
+        generate('-c', 1, '-hw', '--output_dir', tmp_path)
+
+@pytest.mark.parametrize('argv', [['-pws', '0'], ['-pws']])
+def test_invalid_picture_width_step(argv):
+    with pytest.raises(SystemExit):
+        run.parse_arguments(argv)
+
+@pytest.mark.parametrize('argv', [['-dns', '0'], ['-dns']])
+def test_invalid_noise_scale(argv):
+    with pytest.raises(SystemExit):
+        run.parse_arguments(argv)
+
+@pytest.mark.parametrize('argv', [['-hws', '0'], ['-hwa', '0'], ['-hws'], ['-hwa']])
+def test_invalid_handwriting_strokes(argv):
+    with pytest.raises(SystemExit):
+        run.parse_arguments(argv)
+
+@pytest.mark.parametrize('value', ['-1', '0.5', 'none'])
+def test_invalid_non_negative_int_arguments(value):
+    with pytest.raises(argparse.ArgumentTypeError):
+        run.non_negative_int(value)
+
+def test_write_pool_arguments():
+    args = run.parse_arguments(['-wt', '0', '-wq', '1'])
+    assert (args.write_threads, args.write_queue) == (0, 1)
+
+@pytest.mark.parametrize('argv', [['-wt', '-1'], ['-wq', '0'], ['-wt', '1', '-wq', '-2'], ['-wt'], ['-wq']])
+def test_invalid_write_pool_arguments(argv):
+    with pytest.raises(SystemExit):
+        run.parse_arguments(argv)
+
+@pytest.mark.parametrize('flag, dest', [
+    ('-dr', 'degrade_rotate'), ('-dw', 'degrade_warp'), ('-db', 'degrade_blur'), ('-dbl', 'degrade_blobs')
+])
+def test_degradations_need_a_value(flag, dest):
+    assert getattr(run.parse_arguments([flag, '0.5']), dest) == (0.5, 1.0)
+    with pytest.raises(SystemExit):
+        run.parse_arguments([flag])
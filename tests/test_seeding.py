@@ -0,0 +1,38 @@
+import numpy as np
+
+import seeding
+
+from conftest import read_records
+
+def _checksums(records):
+    return {index: (record['image_sha256'], record['label_sha256']) for index, record in records.items()}
+
+def test_sample_generators_are_reproducible():
+    first = seeding.sample_rng(7, 12).random(4)
+    assert np.array_equal(first, seeding.sample_rng(7, 12).random(4))
+    assert not np.array_equal(first, seeding.sample_rng(7, 13).random(4))
+    assert not np.array_equal(first, seeding.sample_rng(8, 12).random(4))
+    assert not np.array_equal(first, seeding.sample_rng(7, 12, seeding.STRING_STREAM).random(4))
+
+def test_index_generators_match_the_sample_generators():
+    rngs = seeding.index_rngs(7, seeding.FONT_STREAM, start=5)
+    for index in range(5, 9):
+        assert next(rngs).random() == seeding.sample_rng(7, index, seeding.FONT_STREAM).random()
+
+def test_unseeded_generators():
+    assert not np.array_equal(seeding.sample_rng(None, 0).random(4), seeding.sample_rng(None, 0).random(4))
+    rngs = seeding.index_rngs(None, seeding.SAMPLE_STREAM)
+    assert next(rngs) is next(rngs)
+
+def test_seeded_runs_do_not_depend_on_threads_or_shards(generate, tmp_path):
+    generate('-c', 6, '-sd', 3, '-t', 1, '--output_dir', tmp_path / 'one')
+    generate('-c', 6, '-sd', 3, '-t', 2, '-ch', 1, '--output_dir', tmp_path / 'two')
+    generate('-c', 6, '-sd', 3, '-nsh', 3, '-shi', 1, '--output_dir', tmp_path / 'shard')
+
+    one = _checksums(read_records(tmp_path / 'one'))
+    assert sorted(one) == list(range(1, 7))
+    assert _checksums(read_records(tmp_path / 'two')) == one
+    assert _checksums(read_records(tmp_path / 'shard')) == {index: one[index] for index in (3, 4)}
+
+    generate('-c', 6, '-sd', 4, '--output_dir', tmp_path / 'other')
+    assert _checksums(read_records(tmp_path / 'other')) != one
@@ -0,0 +1,56 @@
+import io
+import json
+import os
+import tarfile
+
+import numpy as np
+
+from PIL import Image
+
+from shard_writer import ShardWriter
+
+def _line(width, value):
+    return Image.fromarray(np.full((16, width), value, dtype=np.uint8), 'L')
+
+def _read(path, offset, size):
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        return f.read(size)
+
+def test_index_offsets_point_at_the_members(tmp_path):
+    writer = ShardWriter(str(tmp_path), 1 << 20)
+    records = [writer.write(i, 'line_{}.png'.format(i), _line(20 + i, i), 'label {} ü'.format(i)) for i in range(5)]
+    writer.close()
+
+    shards = sorted(p for p in os.listdir(str(tmp_path)) if p.endswith('.tar'))
+    assert len(shards) == 1
+    tar_path = str(tmp_path / shards[0])
+    with open(tar_path[:-4] + '.idx', encoding='utf8') as f:
+        entries = [json.loads(line) for line in f]
+
+    for i, (entry, record) in enumerate(zip(entries, records)):
+        assert record['shard'] == shards[0]
+        assert (record['image_offset'], record['label_offset']) == (entry['image_offset'], entry['label_offset'])
+        image = Image.open(io.BytesIO(_read(tar_path, entry['image_offset'], entry['image_size'])))
+        assert np.array_equal(np.asarray(image), np.asarray(_line(20 + i, i)))
+        assert _read(tar_path, entry['label_offset'], entry['label_size']).decode('utf8') == 'label {} ü'.format(i)
+
+    # A valid tar in WebDataset layout
+    with tarfile.open(tar_path) as tar:
+        assert tar.getnames() == [name for i in range(5) for name in ('line_{}.png'.format(i), 'line_{}.gt.txt'.format(i))]
+
+def test_shards_are_capped(tmp_path):
+    max_bytes = 8 * tarfile.BLOCKSIZE
+    writer = ShardWriter(str(tmp_path), max_bytes)
+    for i in range(6):
+        writer.write(i, '{}.png'.format(i), _line(8, i), str(i))
+    writer.close()
+
+    shards = sorted(p for p in os.listdir(str(tmp_path)) if p.endswith('.tar'))
+    assert writer.shard_count == len(shards) > 1
+    for shard in shards:
+        with tarfile.open(str(tmp_path / shard)) as tar:
+            members = tar.getmembers()
+        assert members
+        # The data of the shard (without the end of archive blocks) stays below the cap
+        assert members[-1].offset_data + members[-1].size <= max_bytes